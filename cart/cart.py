@@ -1,64 +1,75 @@
 from decimal import Decimal
-from django.conf import settings
+from functools import cached_property
 from shop.models import Product
 from coupons.models import Coupon
+from cart.storage import get_cart_storage
+
+
+def get_cart(request):
+    # One cart per request, shared by the context processor and the views so
+    # products, coupon and totals are only resolved once.
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
 
 
 class Cart:
     def __init__(self, request):
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        
-        self.cart = cart
-        
+        self.storage = get_cart_storage(request)
+        self.cart = self.storage.load()
+
         self.coupon_id = self.session.get('coupon_id')
+        self._items = None
+        self._totals = {}
 
     def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
-
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        if self._items is None:
+            products = Product.objects.filter(id__in=self.cart.keys()).with_translations()
+            products = {str(product.id): product for product in products}
+            self._items = []
+            for product_id, item in self.cart.items():
+                if product_id not in products:
+                    continue
+                price = Decimal(item['price'])
+                self._items.append({
+                    'product': products[product_id],
+                    'quantity': item['quantity'],
+                    'price': price,
+                    'total_price': price * item['quantity'],
+                })
+        return iter(self._items)
 
     def __len__(self):
         return sum(item['quantity'] for item in self.cart.values())
 
     def add(self, product, quantity=1, override_quantity=False):
         product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 0, 'price': str(product.price)}
-        
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
-        
+        self.cart[product_id] = self.storage.add(product_id, str(product.price), quantity, override_quantity)
         self.save()
 
     def save(self):
-        self.session.modified = True
+        # drop the memoized lines and totals, the storage backend persists itself
+        self._items = None
+        self._totals = {}
 
     def remove(self, product):
         product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.save()
+        self.storage.remove(product_id)
+        self.cart.pop(product_id, None)
+        self.save()
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
-    
+        if 'total_price' not in self._totals:
+            self._totals['total_price'] = sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        return self._totals['total_price']
+
     def clear(self):
-        del self.session[settings.CART_SESSION_ID]
+        self.storage.clear()
+        self.cart = {}
         self.save()
 
-    @property
+    @cached_property
     def coupon(self):
         if self.coupon_id:
             try:
@@ -66,11 +77,14 @@ class Cart:
             except Coupon.DoesNotExist:
                 pass
         return None
-    
+
     def get_discount(self):
-        if self.coupon:
-            return (self.coupon.discount / Decimal(100)) * self.get_total_price()
-        return Decimal(0)
-    
+        if 'discount' not in self._totals:
+            discount = Decimal(0)
+            if self.coupon:
+                discount = (self.coupon.discount / Decimal(100)) * self.get_total_price()
+            self._totals['discount'] = discount
+        return self._totals['discount']
+
     def get_total_price_after_discount(self):
-        return self.get_total_price() - self.get_discount()
\ No newline at end of file
+        return self.get_total_price() - self.get_discount()
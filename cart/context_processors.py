@@ -1,4 +1,4 @@
-from cart.cart import Cart
+from cart.cart import get_cart
 
 def cart(request):
-    return {'cart': Cart(request)}
\ No newline at end of file
+    return {'cart': get_cart(request)}
\ No newline at end of file
@@ -0,0 +1,125 @@
+import functools
+import uuid
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def get_cart_storage(request):
+    return import_string(settings.CART_STORAGE)(request)
+
+
+@functools.cache
+def get_redis_client(client_class, host, port, db):
+    # one client (and connection pool) per configuration, so overridden settings take effect
+    return import_string(client_class)(host=host, port=port, db=db)
+
+
+class SessionCartStorage:
+    """
+    Keeps the cart as a dict in the session, the whole session row is
+    rewritten on every change.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        cart = self.session.get(settings.CART_SESSION_ID)
+        if not isinstance(cart, dict):
+            cart = self.session[settings.CART_SESSION_ID] = {}
+        self.cart = cart
+
+    def load(self):
+        return self.cart
+
+    def add(self, product_id, price, quantity, override_quantity=False):
+        if product_id not in self.cart:
+            self.cart[product_id] = {'quantity': 0, 'price': price}
+
+        if override_quantity:
+            self.cart[product_id]['quantity'] = quantity
+        else:
+            self.cart[product_id]['quantity'] += quantity
+
+        self.session.modified = True
+        return self.cart[product_id]
+
+    def remove(self, product_id):
+        if product_id in self.cart:
+            del self.cart[product_id]
+            self.session.modified = True
+
+    def clear(self):
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.cart = {}
+        self.session.modified = True
+
+
+class RedisCartStorage:
+    """
+    Keeps every cart in two Redis hashes (quantities and prices) with a TTL.
+
+    The session only holds the cart id, written once when the first product is
+    added, so adding or removing lines never touches the session table and
+    concurrent tabs update quantities atomically with HINCRBY.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        cart_id = self.session.get(settings.CART_SESSION_ID)
+        self.cart_id = cart_id if isinstance(cart_id, str) else None
+
+    def get_client(self):
+        return get_redis_client(settings.CART_REDIS_CLIENT_CLASS, settings.REDIS_HOST, settings.REDIS_PORT, settings.REDIS_DB)
+
+    def get_keys(self):
+        return f"cart:{self.cart_id}:quantities", f"cart:{self.cart_id}:prices"
+
+    def load(self):
+        if not self.cart_id:
+            return {}
+        quantities_key, prices_key = self.get_keys()
+        pipe = self.get_client().pipeline(transaction=False)
+        pipe.hgetall(quantities_key)
+        pipe.hgetall(prices_key)
+        quantities, prices = pipe.execute()
+
+        cart = {}
+        for product_id, quantity in quantities.items():
+            price = prices.get(product_id)
+            if price is None or int(quantity) <= 0:
+                continue
+            cart[product_id.decode()] = {'quantity': int(quantity), 'price': price.decode()}
+        return cart
+
+    def add(self, product_id, price, quantity, override_quantity=False):
+        if not self.cart_id:
+            self.cart_id = self.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+
+        quantities_key, prices_key = self.get_keys()
+        pipe = self.get_client().pipeline()
+        pipe.hsetnx(prices_key, product_id, price)
+        if override_quantity:
+            pipe.hset(quantities_key, product_id, quantity)
+        else:
+            pipe.hincrby(quantities_key, product_id, quantity)
+        pipe.hget(quantities_key, product_id)
+        pipe.hget(prices_key, product_id)
+        pipe.expire(quantities_key, settings.CART_TTL)
+        pipe.expire(prices_key, settings.CART_TTL)
+        results = pipe.execute()
+        return {'quantity': int(results[2]), 'price': results[3].decode()}
+
+    def remove(self, product_id):
+        if not self.cart_id:
+            return
+        quantities_key, prices_key = self.get_keys()
+        pipe = self.get_client().pipeline()
+        pipe.hdel(quantities_key, product_id)
+        pipe.hdel(prices_key, product_id)
+        pipe.execute()
+
+    def clear(self):
+        if not self.cart_id:
+            return
+        self.get_client().unlink(*self.get_keys())
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.cart_id = None
@@ -1,3 +1,98 @@
-from django.test import TestCase
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from cart.cart import Cart
+from cart.storage import RedisCartStorage
+from shop.models import Category, Product
 
-# Create your tests here.
+
+def create_product(price='10.00'):
+    category = Category.objects.language('en').create(name='Tea', slug='tea')
+    return Product.objects.language('en').create(category=category, name='Green tea', slug='green-tea', price=Decimal(price))
+
+
+@override_settings(CART_STORAGE='cart.storage.RedisCartStorage', CART_REDIS_CLIENT_CLASS='fakeredis.FakeRedis')
+class RedisCartStorageTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+        self.storage = RedisCartStorage(self.request)
+        self.redis = self.storage.get_client()
+        self.redis.flushdb()
+
+    def test_client_follows_settings(self):
+        self.assertEqual(type(self.redis).__name__, 'FakeRedis')
+        with override_settings(REDIS_DB=settings.REDIS_DB + 1):
+            self.assertIsNot(self.storage.get_client(), self.redis)
+        self.assertIs(self.storage.get_client(), self.redis)
+
+    def test_add_increments_quantity(self):
+        self.storage.add('1', '10.00', 2)
+        item = self.storage.add('1', '12.00', 3)
+        self.assertEqual(item, {'quantity': 5, 'price': '10.00'})
+        self.assertEqual(RedisCartStorage(self.request).load(), {'1': {'quantity': 5, 'price': '10.00'}})
+
+    def test_add_override_quantity(self):
+        self.storage.add('1', '10.00', 2)
+        item = self.storage.add('1', '10.00', 7, override_quantity=True)
+        self.assertEqual(item['quantity'], 7)
+
+    def test_add_sets_ttl(self):
+        self.storage.add('1', '10.00', 1)
+        for key in self.storage.get_keys():
+            self.assertTrue(0 < self.redis.ttl(key) <= settings.CART_TTL)
+
+    def test_session_only_written_for_first_add(self):
+        self.storage.add('1', '10.00', 1)
+        self.assertTrue(self.request.session.modified)
+        self.request.session.modified = False
+        self.storage.add('2', '5.00', 1)
+        self.storage.add('1', '10.00', 1)
+        self.assertFalse(self.request.session.modified)
+
+    def test_remove(self):
+        self.storage.add('1', '10.00', 1)
+        self.storage.add('2', '5.00', 1)
+        self.storage.remove('1')
+        self.assertEqual(list(self.storage.load()), ['2'])
+
+    def test_clear(self):
+        self.storage.add('1', '10.00', 1)
+        keys = self.storage.get_keys()
+        self.storage.clear()
+        self.assertEqual(self.redis.exists(*keys), 0)
+        self.assertNotIn(settings.CART_SESSION_ID, self.request.session)
+        self.assertEqual(self.storage.load(), {})
+
+    def test_cart_totals(self):
+        product = create_product('10.00')
+        cart = Cart(self.request)
+        cart.add(product, 2)
+        cart.add(product, 1)
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_total_price(), Decimal('30.00'))
+        cart.remove(product)
+        self.assertEqual(len(Cart(self.request)), 0)
+
+    def test_cart_add_view_does_not_rewrite_session(self):
+        product = create_product()
+        url = reverse('cart:cart_add', args=[product.id])
+        self.client.post(url, {'quantity': 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'quantity': 2})
+        self.assertEqual(response.status_code, 302)
+        session_writes = [
+            query['sql'] for query in queries
+            if 'django_session' in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(session_writes, [])
+        self.assertEqual(len(Cart(self.client_request())), 3)
+
+    def client_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        return request
@@ -1,7 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.decorators.http import require_POST
 from shop.models import Product
-from cart.cart import Cart
+from cart.cart import get_cart
 from cart.forms import CartAddProductForm
 from coupons.forms import CouponApplyForm
 from shop.recommender import Recommender
@@ -9,7 +9,7 @@ from shop.recommender import Recommender
 # Create your views here.
 @require_POST
 def cart_add(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
@@ -25,7 +25,7 @@ def cart_add(request, product_id):
 
 @require_POST
 def cart_remove(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
 
@@ -33,7 +33,7 @@ def cart_remove(request, product_id):
 
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     for item in cart:
         item['update_quantity_form'] = CartAddProductForm(initial={'quantity': item['quantity'], 'override': True})
     
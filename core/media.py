@@ -0,0 +1,134 @@
+import mimetypes
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.files.storage import storages
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class FileRange:
+    """
+    Read at most ``length`` bytes of ``file`` from ``start``. The file is
+    left positioned at ``start`` and fileno() is kept, so WSGI servers with a
+    sendfile file_wrapper still send the range without reading it in Python.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def get_range(header, size):
+    # (start, end) of a single byte range, None for the whole file, multiple
+    # ranges are answered with the whole file as the RFC allows
+    match = RANGE_RE.fullmatch(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # suffix range, the last ``end`` bytes
+        return max(0, size - int(end)), size - 1 if int(end) else -1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if end < start and start < size:
+        return None
+    return start, end
+
+
+def is_range_fresh(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    return if_range is None or if_range in (etag, http_date(last_modified))
+
+
+def get_accel_headers(alias, storage, name):
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        location = settings.MEDIA_ACCEL_LOCATIONS.get(alias)
+        if location:
+            return {'X-Accel-Redirect': quote(location + name)}
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        try:
+            return {'X-Sendfile': storage.path(name)}
+        except NotImplementedError:
+            pass
+    return None
+
+
+def serve_file(request, alias, name, content_type=None, as_attachment=False, filename='', etag=None):
+    """
+    Return a response sending the file ``name`` of the storage ``alias``.
+
+    The front proxy sends the file itself when MEDIA_SENDFILE is set, otherwise
+    it is streamed from an open file handle with Range and conditional
+    request support, it is never read into memory whole.
+    """
+    storage = storages[alias]
+    try:
+        size = storage.size(name)
+        last_modified = int(storage.get_modified_time(name).timestamp())
+    except FileNotFoundError:
+        raise Http404
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    filename = filename or name.rsplit('/', 1)[-1]
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accel_headers = get_accel_headers(alias, storage, name)
+    if accel_headers:
+        # the proxy handles ranges itself, the body is never read here
+        response = HttpResponse(content_type=content_type, headers=accel_headers)
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    else:
+        byte_range = None
+        if 'Range' in request.headers and is_range_fresh(request, etag, last_modified):
+            byte_range = get_range(request.headers['Range'], size)
+        if byte_range is not None and byte_range[0] >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        try:
+            file = storage.open(name, 'rb')
+        except (FileNotFoundError, IsADirectoryError):
+            raise Http404
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type, as_attachment=as_attachment, filename=filename)
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            response = FileResponse(
+                FileRange(file, start, end - start + 1),
+                status=206, content_type=content_type, as_attachment=as_attachment, filename=filename,
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Last-Modified'] = http_date(last_modified)
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    return serve_file(request, 'default', path)
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'orders',
     'payment',
     'coupons',
+    'mailer',
 
     'rosetta',
     'parler',
@@ -80,10 +81,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # concurrent checkouts wait for the write lock instead of failing
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+        # a file, the in-memory default fails concurrent writers and the
+        # checkout concurrency test could not run
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # flags every web and Celery process must see, such as a scheduled rebuild,
+    # create the table with manage.py createcachetable
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -131,6 +150,61 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # rendered invoice PDFs, kept out of the public media folder
+    'invoices': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': BASE_DIR / 'private' / 'invoices',
+            'allow_overwrite': True,
+        },
+    },
+    # admin CSV exports and invoice archives, downloaded by staff only
+    'exports': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': BASE_DIR / 'private' / 'exports',
+            'allow_overwrite': True,
+        },
+    },
+    # attachments of the queued e-mails, deleted once they are sent
+    'mailer': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': BASE_DIR / 'private' / 'mailer',
+        },
+    },
+}
+INVOICE_STORAGE = 'invoices'
+# One stored invoice per order version, rendered in this language whoever asks for it
+INVOICE_LANGUAGE = LANGUAGE_CODE
+EXPORT_STORAGE = 'exports'
+INVOICE_STYLESHEETS = ['css/pdf.css']
+# Warm WeasyPrint processes used by web workers, 0 renders in-process
+INVOICE_RENDER_WORKERS = 2
+INVOICE_RENDER_QUEUE_SIZE = 32
+# Larger invoice archives are built by a Celery task and e-mailed
+INVOICE_ZIP_ASYNC_THRESHOLD = 200
+# Orders rendered by each Celery task of a large invoice archive
+INVOICE_RENDER_CHUNK_SIZE = 100
+# Serve MEDIA_URL through Django, off by default in production where the proxy serves it
+MEDIA_SERVE = config('MEDIA_SERVE', default=DEBUG, cast=bool)
+# Hand file downloads to the front proxy: '' streams them from Django,
+# 'x-accel-redirect' for nginx or 'x-sendfile' for Apache and lighttpd
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+# Internal nginx locations aliasing the directory of each storage, for X-Accel-Redirect
+MEDIA_ACCEL_LOCATIONS = {
+    'default': '/internal/media/',
+    'invoices': '/internal/invoices/',
+    'exports': '/internal/exports/',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -142,18 +216,89 @@ DAISY_SETTINGS = {
 }
 
 CART_SESSION_ID = 'cart'
+CART_STORAGE = 'cart.storage.SessionCartStorage'  # or 'cart.storage.RedisCartStorage'
+CART_REDIS_CLIENT_CLASS = 'redis.Redis'  # 'fakeredis.FakeRedis' in tests
+CART_TTL = 60 * 60 * 24 * 7
+
+# Unpaid orders give their reserved stock back after this many seconds
+INVENTORY_RESERVATION_TIMEOUT = 60 * 30
+
+SHOP_PAGE_SIZE = 24
+SHOP_MAX_PAGE_SIZE = 100
+# Upper bounds of the price ranges shoppers can filter by, the last range is open
+SHOP_PRICE_BUCKETS = [25, 50, 100, 250]
+
+# Widths of the WebP and JPEG copies made of every product image
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640, 1280]
+PRODUCT_IMAGE_QUALITY = 80
+
+# SQLite FTS5 index used by the product search, one table per language
+SEARCH_INDEX_PATH = BASE_DIR / 'private' / 'search.sqlite3'
+# Attempts of an index update that finds the index locked, the first retry
+# after SEARCH_INDEX_RETRY_DELAY seconds, then doubled
+SEARCH_INDEX_MAX_RETRIES = 5
+SEARCH_INDEX_RETRY_DELAY = 2
+
+# Memory-mapped autocomplete snapshots, rebuilt in the background when the catalog changes
+AUTOCOMPLETE_DIR = BASE_DIR / 'private' / 'autocomplete'
+AUTOCOMPLETE_MAX_RESULTS = 10
+# Seconds to wait after a catalog change so a batch of edits triggers one rebuild
+AUTOCOMPLETE_REBUILD_DELAY = 30
+# Seconds between checks of every worker for a newer snapshot
+AUTOCOMPLETE_RELOAD_INTERVAL = 5
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Transactional e-mails are queued and sent in batches over one connection
+MAILER_STORAGE = 'mailer'
+MAILER_BATCH_SIZE = 100
+# Seconds between the first queued message and the flush that sends it
+MAILER_FLUSH_WINDOW = 5
+MAILER_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled on every failed attempt
+MAILER_RETRY_DELAY = 60
+
+CSV_EXPORT_CHUNK_SIZE = 2000
+# Larger admin exports are written to EXPORT_STORAGE by a Celery task and e-mailed
+CSV_EXPORT_ASYNC_THRESHOLD = 50000
+
 
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
 STRIPE_API_VERSION = config('STRIPE_API_VERSION')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET')
+# Point at a local stub such as stripe-mock (http://localhost:12111) in development
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+# (connect, read) timeouts in seconds for calls made while the customer waits
+STRIPE_TIMEOUT = (3, 10)
+STRIPE_MAX_NETWORK_RETRIES = 1
+# Serve payment:process with the async view, only when running under ASGI
+PAYMENT_ASYNC_CHECKOUT = config('PAYMENT_ASYNC_CHECKOUT', default=False, cast=bool)
 
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 1
+REDIS_SOCKET_TIMEOUT = 5
+REDIS_CONNECT_TIMEOUT = 2
+REDIS_MAX_CONNECTIONS = 50
+
+# Seconds a set of suggestions is cached per product set and language, the
+# stale copy is served while Redis is slow or down
+RECOMMENDER_CACHE_TIMEOUT = 300
+RECOMMENDER_STALE_TIMEOUT = 60 * 60 * 24
+# Storefront reads give up after this many seconds, the circuit opens after
+# RECOMMENDER_FAILURE_THRESHOLD failed or slow calls in a row
+RECOMMENDER_LATENCY_BUDGET = 0.005
+RECOMMENDER_FAILURE_THRESHOLD = 5
+RECOMMENDER_RESET_TIMEOUT = 30
+# How many times max_results to read from every set when merging suggestions
+RECOMMENDER_MERGE_WINDOW = 4
+# Co-purchase scores halve every RECOMMENDER_DECAY_HALF_LIFE seconds, applied
+# every RECOMMENDER_DECAY_INTERVAL, sets keep their RECOMMENDER_MAX_RELATED best
+RECOMMENDER_DECAY_HALF_LIFE = 60 * 60 * 24 * 30
+RECOMMENDER_DECAY_INTERVAL = 60 * 60 * 24
+RECOMMENDER_MAX_RELATED = 100
+RECOMMENDER_MIN_SCORE = 0.05
 
 PARLER_LANGUAGES = {
     None: (
@@ -164,4 +309,29 @@ PARLER_LANGUAGES = {
         'fallback': 'en',
         'hide_untranslated': False,
     }
-}
\ No newline at end of file
+}
+
+# Results are only kept for the tasks that opt in, the chunks of a chord
+CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
+CELERY_TASK_IGNORE_RESULT = True
+
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-reservations': {
+        'task': 'shop.tasks.release_expired_reservations',
+        'schedule': 60.0,
+    },
+    'decay-recommendations': {
+        'task': 'shop.tasks.decay_recommendations',
+        'schedule': RECOMMENDER_DECAY_INTERVAL,
+    },
+    # popularity moves with every purchase, not only with catalog changes
+    'rebuild-autocomplete': {
+        'task': 'shop.tasks.rebuild_autocomplete',
+        'schedule': 60.0 * 60,
+    },
+    # picks up retries and anything a lost flush left behind
+    'flush-outbox': {
+        'task': 'mailer.tasks.flush_outbox',
+        'schedule': 60.0,
+    },
+}
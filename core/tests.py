@@ -0,0 +1,115 @@
+import tempfile
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+from core import media
+
+CONTENT = b'0123456789'
+NAME = 'docs/price list.txt'
+ETAG = '"v2"'
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        default_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location.name}}
+        storages_override = override_settings(STORAGES={**settings.STORAGES, 'default': default_storage}, MEDIA_SENDFILE='')
+        storages_override.enable()
+        self.addCleanup(storages_override.disable)
+        storages['default'].save(NAME, ContentFile(CONTENT))
+        self.last_modified = http_date(storages['default'].get_modified_time(NAME).timestamp())
+
+    def serve(self, name=NAME, **headers):
+        request = RequestFactory().get('/media/' + name, headers=headers)
+        return media.serve_file(request, 'default', name, etag=ETAG)
+
+    def assertContent(self, response, status, content):
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        response.close()
+
+    def test_get_range(self):
+        for header, byte_range in [
+            ('bytes=2-5', (2, 5)),
+            ('bytes=8-', (8, 9)),
+            ('bytes=8-100', (8, 9)),
+            ('bytes=-3', (7, 9)),
+            ('bytes=-100', (0, 9)),
+            ('bytes=10-', (10, 9)),
+            ('bytes=5-2', None),
+            ('bytes=-', None),
+            ('bytes=0-1,4-5', None),
+            ('items=0-1', None),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(media.get_range(header, len(CONTENT)), byte_range)
+
+    def test_full_file(self):
+        response = self.serve()
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Last-Modified'], self.last_modified)
+        self.assertEqual(response['ETag'], ETAG)
+        self.assertContent(response, 200, CONTENT)
+
+    def test_single_range(self):
+        response = self.serve(Range='bytes=2-5')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertContent(response, 206, b'2345')
+
+    def test_suffix_range(self):
+        response = self.serve(Range='bytes=-3')
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+        self.assertContent(response, 206, b'789')
+
+    def test_multiple_ranges_send_the_full_file(self):
+        self.assertContent(self.serve(Range='bytes=0-1,4-5'), 200, CONTENT)
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=10-', 'bytes=-0'):
+            with self.subTest(header=header):
+                response = self.serve(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        # the range only applies to the version of the file the client has
+        self.assertContent(self.serve(Range='bytes=2-5', **{'If-Range': '"v1"'}), 200, CONTENT)
+        self.assertContent(self.serve(Range='bytes=2-5', **{'If-Range': ETAG}), 206, b'2345')
+        self.assertContent(self.serve(Range='bytes=2-5', **{'If-Range': self.last_modified}), 206, b'2345')
+
+    def test_conditional_requests(self):
+        self.assertEqual(self.serve(**{'If-None-Match': ETAG}).status_code, 304)
+        self.assertEqual(self.serve(**{'If-Modified-Since': self.last_modified}).status_code, 304)
+        self.assertContent(self.serve(**{'If-None-Match': '"v1"'}), 200, CONTENT)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_LOCATIONS={'default': '/internal/media/'})
+    def test_x_accel_redirect(self):
+        response = self.serve(Range='bytes=2-5')
+        # the proxy sends the file and answers the range itself
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/media/docs/price%20list.txt')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="price list.txt"')
+        self.assertEqual(response['ETag'], ETAG)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.serve()
+        self.assertEqual(response['X-Sendfile'], storages['default'].path(NAME))
+        self.assertEqual(response.content, b'')
+
+    def test_missing_file(self):
+        with self.assertRaises(Http404):
+            self.serve('docs/missing.txt')
+
+    def test_path_traversal_is_rejected(self):
+        for name in ('../settings.py', 'docs/../../settings.py', '/etc/passwd'):
+            with self.subTest(name=name), self.assertRaises(SuspiciousFileOperation):
+                media.serve_media(RequestFactory().get('/media/'), name)
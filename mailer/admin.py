@@ -0,0 +1,11 @@
+from django.contrib import admin
+from mailer.models import QueuedEmail
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subject', 'to', 'status', 'attempts', 'next_attempt', 'created', 'sent']
+    list_filter = ['status', 'created', 'sent']
+    search_fields = ['subject', 'to']
+    exclude = ['message']
+    readonly_fields = ['subject', 'to', 'status', 'attempts', 'next_attempt', 'last_error', 'sent']
@@ -0,0 +1,109 @@
+"""
+Django management command to compare the throughput, in messages per second,
+of sending every e-mail over a connection of its own and of queuing them and
+flushing the outbox in batches over one connection.
+
+Messages go to the locmem backend, --handshake simulates the cost of opening
+an SMTP connection (TCP, TLS and AUTH). The queued rows are rolled back at
+the end.
+
+Usage: uv run python manage.py benchmark_outbox --messages 500 --handshake 100
+"""
+
+import time
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends import locmem
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mailer import outbox
+
+
+class Rollback(Exception):
+    pass
+
+
+class HandshakeBackend(locmem.EmailBackend):
+    # opens and closes around send_messages() like the SMTP backend, paying
+    # the handshake for every connection it opens
+    handshake = 0
+    connections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        HandshakeBackend.connections += 1
+        time.sleep(self.handshake)
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        new_connection = self.open()
+        try:
+            return super().send_messages(messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark e-mails per second sent one connection each and through the batched outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='E-mails sent by every run')
+        parser.add_argument('--handshake', type=float, default=100, help='Simulated connection setup in milliseconds')
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages per outbox batch')
+        parser.add_argument('--attachment', type=int, default=50, help='Size of a PDF-like attachment in KB, 0 for none')
+
+    def get_messages(self, count, attachment):
+        messages = []
+        for i in range(count):
+            email = EmailMessage(f'Order nr. {i}', 'Please, find attached your invoice.', 'admin@myshop.com', [f'customer{i}@example.com'])
+            if attachment:
+                email.attach(f'order_{i}.pdf', b'%PDF' + b'0' * attachment * 1024, 'application/pdf')
+            messages.append(email)
+        return messages
+
+    def report(self, label, count, elapsed, connections):
+        self.stdout.write(f'{label:<32} {count / elapsed:>9.1f} msgs/s {elapsed:>8.2f} s {connections:>6} connections')
+
+    def handle(self, *args, **options):
+        HandshakeBackend.handshake = options['handshake'] / 1000
+        count = options['messages']
+        messages = self.get_messages(count, options['attachment'])
+        get_connection = outbox.get_connection
+        try:
+            HandshakeBackend.connections = 0
+            start = time.perf_counter()
+            for email in messages:
+                email.connection = HandshakeBackend()
+                email.send()
+            self.report('One connection per message', count, time.perf_counter() - start, HandshakeBackend.connections)
+
+            outbox.get_connection = HandshakeBackend
+            try:
+                with transaction.atomic():
+                    HandshakeBackend.connections = 0
+                    start = time.perf_counter()
+                    for email in messages:
+                        email.connection = None
+                        outbox.enqueue(email)
+                    enqueued = time.perf_counter()
+                    sent = outbox.flush(options['batch_size'])
+                    end = time.perf_counter()
+                    self.report('Outbox, enqueue', count, enqueued - start, 0)
+                    self.report(f'Outbox, flush in batches of {options["batch_size"]}', sent, end - enqueued, HandshakeBackend.connections)
+                    self.report('Outbox, enqueue and flush', sent, end - start, HandshakeBackend.connections)
+                    raise Rollback
+            except Rollback:
+                pass
+        finally:
+            outbox.get_connection = get_connection
+            mail.outbox = []
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:05
+
+import pickle
+import django.db.models.deletion
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import migrations, models
+
+
+def unpickle_queued_messages(apps, schema_editor):
+    # the last time the pickles are loaded, they were written by this app
+    QueuedEmail = apps.get_model('mailer', 'QueuedEmail')
+    QueuedAttachment = apps.get_model('mailer', 'QueuedAttachment')
+    storage = storages[settings.MAILER_STORAGE]
+    for queued in QueuedEmail.objects.filter(status='queued').iterator():
+        email = pickle.loads(queued.message)
+        queued.data = {
+            'subject': email.subject,
+            'body': email.body,
+            'from_email': email.from_email,
+            'to': email.to,
+            'cc': email.cc,
+            'bcc': email.bcc,
+            'reply_to': email.reply_to,
+            'headers': email.extra_headers,
+            'content_subtype': email.content_subtype,
+            'alternatives': [[content, mimetype] for content, mimetype in getattr(email, 'alternatives', [])],
+        }
+        queued.save(update_fields=['data'])
+        for filename, content, mimetype in email.attachments:
+            if isinstance(content, str):
+                content = content.encode()
+            name = storage.save(f'attachments/{queued.id}_{storage.get_valid_name(filename)}', ContentFile(content))
+            QueuedAttachment.objects.create(email=queued, name=name, filename=filename, mimetype=mimetype or '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedemail',
+            name='data',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.CreateModel(
+            name='QueuedAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('filename', models.CharField(max_length=255)),
+                ('mimetype', models.CharField(blank=True, max_length=255)),
+                ('email', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='mailer.queuedemail')),
+            ],
+        ),
+        migrations.RunPython(unpickle_queued_messages, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='queuedemail',
+            name='message',
+        ),
+        migrations.RenameField(
+            model_name='queuedemail',
+            old_name='data',
+            new_name='message',
+        ),
+        migrations.AlterField(
+            model_name='queuedemail',
+            name='message',
+            field=models.JSONField(),
+        ),
+    ]
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.core.mail import EmailMultiAlternatives
+from django.db import models
+from django.utils import timezone
+
+
+def get_attachment_storage():
+    return storages[settings.MAILER_STORAGE]
+
+
+class QueuedEmail(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    subject = models.CharField(max_length=255)
+    to = models.CharField(max_length=255)
+    # the fields of the EmailMessage, its attachments are QueuedAttachment files
+    message = models.JSONField()
+    status = models.CharField(max_length=10, choices=Status, default=Status.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt']),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to}'
+
+    @classmethod
+    def from_message(cls, email):
+        return cls(
+            subject=email.subject[:255],
+            to=', '.join(email.to)[:255],
+            message={
+                'subject': email.subject,
+                'body': email.body,
+                'from_email': email.from_email,
+                'to': email.to,
+                'cc': email.cc,
+                'bcc': email.bcc,
+                'reply_to': email.reply_to,
+                'headers': email.extra_headers,
+                'content_subtype': email.content_subtype,
+                'alternatives': [[content, mimetype] for content, mimetype in getattr(email, 'alternatives', [])],
+            },
+        )
+
+    def save_attachments(self, email):
+        storage = get_attachment_storage()
+        attachments = []
+        for attachment in email.attachments:
+            if not isinstance(attachment, tuple):
+                raise TypeError('Only (filename, content, mimetype) attachments can be queued')
+            filename, content, mimetype = attachment
+            if isinstance(content, str):
+                content = content.encode()
+            name = storage.save(f'attachments/{self.id}_{storage.get_valid_name(filename)}', ContentFile(content))
+            attachments.append(QueuedAttachment(email=self, name=name, filename=filename, mimetype=mimetype or ''))
+        QueuedAttachment.objects.bulk_create(attachments)
+
+    def get_message(self):
+        data = self.message
+        email = EmailMultiAlternatives(
+            data['subject'], data['body'], data['from_email'], data['to'],
+            bcc=data['bcc'], cc=data['cc'], reply_to=data['reply_to'], headers=data['headers'],
+            alternatives=[tuple(alternative) for alternative in data['alternatives']],
+        )
+        email.content_subtype = data['content_subtype']
+        for attachment in self.attachments.all():
+            email.attach(attachment.filename, attachment.read(), attachment.mimetype or None)
+        return email
+
+
+class QueuedAttachment(models.Model):
+    email = models.ForeignKey(QueuedEmail, related_name='attachments', on_delete=models.CASCADE)
+    # where the content is stored in MAILER_STORAGE
+    name = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    mimetype = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return self.filename
+
+    def read(self):
+        with get_attachment_storage().open(self.name, 'rb') as f:
+            return f.read()
@@ -0,0 +1,136 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+from mailer.models import QueuedAttachment, QueuedEmail, get_attachment_storage
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SCHEDULED_KEY = 'mailer:flush-scheduled'
+
+
+def enqueue(email):
+    """
+    Store ``email`` in the outbox and make sure a flush runs at most
+    MAILER_FLUSH_WINDOW seconds after the current transaction commits, so
+    messages queued close together go out over the same connection.
+    """
+    queued = QueuedEmail.from_message(email)
+    queued.save()
+    queued.save_attachments(email)
+    transaction.on_commit(schedule_flush)
+    return queued
+
+
+def schedule_flush():
+    from mailer.tasks import flush_outbox
+    window = settings.MAILER_FLUSH_WINDOW
+    # shared by every process, a burst of messages schedules a single flush
+    if caches['shared'].add(FLUSH_SCHEDULED_KEY, True, window):
+        flush_outbox.apply_async(countdown=window)
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=settings.MAILER_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def iter_messages(pending, attempted):
+    # hands the messages to the backend one at a time and records which row
+    # is being sent, so an exception raised by send_messages() names its message
+    for queued in pending:
+        attempted.append(queued)
+        yield queued.get_message()
+
+
+def mark_sent(queued):
+    queued.attempts += 1
+    queued.status = QueuedEmail.Status.SENT
+    queued.sent = timezone.now()
+    queued.last_error = ''
+
+
+def mark_failed(queued, exc):
+    queued.attempts += 1
+    queued.last_error = repr(exc)
+    if queued.attempts >= settings.MAILER_MAX_ATTEMPTS:
+        queued.status = QueuedEmail.Status.FAILED
+        logger.error('Giving up on e-mail %s after %s attempts: %r', queued.id, queued.attempts, exc)
+    else:
+        queued.next_attempt = timezone.now() + get_retry_delay(queued.attempts)
+
+
+def send_batch(batch_size=None):
+    """
+    Send up to ``batch_size`` due messages with one send_messages() call over
+    one SMTP connection, returns how many were picked.
+
+    A message that fails is retried with exponential backoff until
+    MAILER_MAX_ATTEMPTS, the rest of the batch goes on over a new connection.
+    """
+    batch_size = batch_size or settings.MAILER_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            QueuedEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=QueuedEmail.Status.QUEUED, next_attempt__lte=now)
+            .prefetch_related('attachments')
+            .order_by('next_attempt', 'id')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        connection = get_connection()
+        connection.open()
+        pending = batch
+        try:
+            while pending:
+                attempted = []
+                try:
+                    connection.send_messages(iter_messages(pending, attempted))
+                except Exception as exc:
+                    # the messages before the one being sent when it raised went out
+                    failed = attempted[-1] if attempted else pending[0]
+                    index = pending.index(failed)
+                    for queued in pending[:index]:
+                        mark_sent(queued)
+                    mark_failed(failed, exc)
+                    pending = pending[index + 1:]
+                    # the connection may be broken, go on with the batch on a new one
+                    try:
+                        connection.close()
+                        connection.open()
+                    except Exception:
+                        logger.exception('Could not reconnect to the mail server')
+                        break
+                else:
+                    # messages the backend did not get to stay queued for the next flush
+                    for queued in attempted:
+                        mark_sent(queued)
+                    pending = []
+        finally:
+            connection.close()
+        QueuedEmail.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt', 'last_error', 'sent'])
+    delete_attachments([queued for queued in batch if queued.status == QueuedEmail.Status.SENT])
+    return len(batch)
+
+
+def delete_attachments(emails):
+    attachments = QueuedAttachment.objects.filter(email__in=emails)
+    storage = get_attachment_storage()
+    for name in attachments.values_list('name', flat=True):
+        storage.delete(name)
+    attachments.delete()
+
+
+def flush(batch_size=None):
+    batch_size = batch_size or settings.MAILER_BATCH_SIZE
+    total = 0
+    while True:
+        picked = send_batch(batch_size)
+        total += picked
+        if picked < batch_size:
+            return total
@@ -0,0 +1,10 @@
+from celery import shared_task
+from django.core.cache import caches
+from mailer import outbox
+
+
+@shared_task
+def flush_outbox():
+    # messages queued from now on schedule the next flush
+    caches['shared'].delete(outbox.FLUSH_SCHEDULED_KEY)
+    return outbox.flush()
@@ -0,0 +1,177 @@
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mailer import outbox
+from mailer.models import QueuedAttachment, QueuedEmail, get_attachment_storage
+from mailer.tasks import flush_outbox
+from orders.tasks import order_created
+from orders.tests import create_order
+from payment.tasks import payment_completed
+
+
+class FailingBackend(EmailBackend):
+    # delivers like locmem but refuses every message to bad@example.com
+    def send_messages(self, messages):
+        def check(messages):
+            for message in messages:
+                if 'bad@example.com' in message.to:
+                    raise ConnectionError('Recipient refused')
+                yield message
+        return super().send_messages(check(messages))
+
+
+def use_temporary_storage(test):
+    location = tempfile.TemporaryDirectory()
+    test.addCleanup(location.cleanup)
+    mailer_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location.name}}
+    storages_override = override_settings(STORAGES={**settings.STORAGES, 'mailer': mailer_storage})
+    storages_override.enable()
+    test.addCleanup(storages_override.disable)
+
+
+def queue(*recipients):
+    return [outbox.enqueue(EmailMessage('Hello', 'Body', 'admin@myshop.com', [to])) for to in recipients]
+
+
+@mock.patch('mailer.outbox.schedule_flush')
+class OutboxTests(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+
+    def test_message_is_stored_as_json(self, schedule_flush):
+        email = EmailMultiAlternatives(
+            'Hello', 'Body', 'admin@myshop.com', ['ada@example.com'], cc=['alan@example.com'],
+            reply_to=['support@myshop.com'], headers={'X-Order': '1'},
+        )
+        email.attach_alternative('<p>Body</p>', 'text/html')
+        email.attach('invoice.pdf', b'%PDF', 'application/pdf')
+        queued = outbox.enqueue(email)
+
+        queued = QueuedEmail.objects.get(id=queued.id)
+        self.assertEqual(queued.message['cc'], ['alan@example.com'])
+        attachment = queued.attachments.get()
+        self.assertTrue(get_attachment_storage().exists(attachment.name))
+
+        message = queued.get_message()
+        for attr in ('subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'reply_to', 'extra_headers', 'alternatives', 'attachments'):
+            self.assertEqual(getattr(message, attr), getattr(email, attr), attr)
+
+        outbox.flush()
+        self.assertEqual(mail.outbox[0].attachments, email.attachments)
+        # sent, the attachment is not kept
+        self.assertFalse(QueuedAttachment.objects.exists())
+        self.assertFalse(get_attachment_storage().exists(attachment.name))
+
+    def test_enqueue_schedules_flush_on_commit(self, schedule_flush):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue('ada@example.com', 'alan@example.com')
+        schedule_flush.assert_has_calls([mock.call(), mock.call()])
+        self.assertEqual(QueuedEmail.objects.filter(status=QueuedEmail.Status.QUEUED).count(), 2)
+        self.assertEqual(mail.outbox, [])
+
+    def test_batch_is_sent_over_one_connection(self, schedule_flush):
+        queue(*[f'user{i}@example.com' for i in range(5)])
+        connections = []
+
+        def get_connection():
+            connection = EmailBackend()
+            connection.send_messages = mock.Mock(wraps=connection.send_messages)
+            connections.append(connection)
+            return connection
+
+        with mock.patch('mailer.outbox.get_connection', side_effect=get_connection):
+            outbox.flush(batch_size=2)
+
+        # batches of 2, 2 and 1, each one send_messages() call on its own connection
+        self.assertEqual(len(connections), 3)
+        for connection in connections:
+            connection.send_messages.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(QueuedEmail.objects.exclude(status=QueuedEmail.Status.SENT).exists())
+
+    @override_settings(EMAIL_BACKEND='mailer.tests.FailingBackend', MAILER_MAX_ATTEMPTS=3, MAILER_RETRY_DELAY=60)
+    def test_failed_message_backs_off_then_fails(self, schedule_flush):
+        good, bad, other = queue('ada@example.com', 'bad@example.com', 'alan@example.com')
+        before = timezone.now()
+        self.assertEqual(outbox.send_batch(), 3)
+
+        # the failure holds back neither the message before it nor the one after
+        self.assertEqual([message.to for message in mail.outbox], [['ada@example.com'], ['alan@example.com']])
+        for queued in (good, other):
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, QueuedEmail.Status.SENT)
+        bad.refresh_from_db()
+        self.assertEqual(bad.status, QueuedEmail.Status.QUEUED)
+        self.assertEqual(bad.attempts, 1)
+        self.assertIn('Recipient refused', bad.last_error)
+        self.assertGreaterEqual(bad.next_attempt, before + timedelta(seconds=60))
+
+        # not due yet
+        self.assertEqual(outbox.send_batch(), 0)
+
+        QueuedEmail.objects.filter(id=bad.id).update(next_attempt=timezone.now())
+        before = timezone.now()
+        outbox.send_batch()
+        bad.refresh_from_db()
+        self.assertEqual(bad.attempts, 2)
+        self.assertGreaterEqual(bad.next_attempt, before + timedelta(seconds=120))
+
+        QueuedEmail.objects.filter(id=bad.id).update(next_attempt=timezone.now())
+        with self.assertLogs('mailer.outbox', 'ERROR'):
+            outbox.send_batch()
+        bad.refresh_from_db()
+        self.assertEqual(bad.status, QueuedEmail.Status.FAILED)
+        self.assertEqual(bad.attempts, 3)
+        self.assertEqual(outbox.send_batch(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+@mock.patch('mailer.tasks.flush_outbox.apply_async')
+class ScheduleFlushTests(TestCase):
+    def test_one_flush_per_window(self, apply_async):
+        outbox.schedule_flush()
+        # the flag is in the database, so another process sees it as well
+        caches['default'].clear()
+        outbox.schedule_flush()
+        apply_async.assert_called_once_with(countdown=settings.MAILER_FLUSH_WINDOW)
+
+        flush_outbox()
+        outbox.schedule_flush()
+        self.assertEqual(apply_async.call_count, 2)
+
+
+@mock.patch('mailer.outbox.schedule_flush')
+class OrderEmailTests(TestCase):
+    def setUp(self):
+        use_temporary_storage(self)
+        self.order = create_order()
+
+    def test_order_created_is_queued(self, schedule_flush):
+        with self.captureOnCommitCallbacks(execute=True):
+            order_created(self.order.id)
+        schedule_flush.assert_called_once()
+        self.assertEqual(mail.outbox, [])
+        message = QueuedEmail.objects.get().get_message()
+        self.assertEqual(message.to, [self.order.email])
+        self.assertEqual(message.subject, f'Order nr. {self.order.id}')
+
+    @mock.patch('payment.tasks.read_invoice', return_value=b'%PDF')
+    def test_payment_completed_is_queued(self, read_invoice, schedule_flush):
+        with self.captureOnCommitCallbacks(execute=True):
+            payment_completed(self.order.id)
+        schedule_flush.assert_called_once()
+        self.assertEqual(mail.outbox, [])
+        message = QueuedEmail.objects.get().get_message()
+        self.assertEqual(message.to, [self.order.email])
+        self.assertEqual(message.attachments[0][:2], (f'order_{self.order.id}.pdf', b'%PDF'))
+
+        outbox.flush()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments[0][1], b'%PDF')
@@ -2,7 +2,7 @@ from django.contrib import admin
 from orders.models import Order, OrderItem
 from django_daisy.mixins import NavTabMixin
 from django.utils.safestring import mark_safe
-from orders.custom_actions import export_to_csv
+from orders.custom_actions import export_invoices_zip, export_to_csv, export_to_csv_with_items
 from django.urls import reverse
 # Register your models here.
 
@@ -34,8 +34,13 @@ class OrderItemInline(admin.TabularInline, NavTabMixin):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'first_name', 'last_name', 'email', 'address', 'postal_code', 'city', 'paid', order_payment, 'created', 'updated', order_detail, order_pdf]
+    list_display = ['id', 'first_name', 'last_name', 'email', 'address', 'postal_code', 'city', 'paid', 'total', order_payment, 'created', 'updated', order_detail, order_pdf]
     list_display_links = ['id', 'first_name', 'last_name']
     list_filter = ['paid', 'created', 'updated']
+    readonly_fields = ['subtotal', 'discount_amount', 'total']
     inlines = [OrderItemInline]
-    actions = [export_to_csv]
\ No newline at end of file
+    actions = [export_to_csv, export_to_csv_with_items, export_invoices_zip]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_totals()
\ No newline at end of file
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from parler.utils.i18n import get_active_language_choices
+from orders.models import Order, OrderItem
+from shop.models import Product
+
+
+def with_order_details(queryset):
+    """
+    Load the coupon, items, products and the active product translations in
+    three queries whatever the number of items, with the invoice language's
+    as well so invoices need no extra query.
+    """
+    translations_model = Product._parler_meta.root_model
+    languages = {*get_active_language_choices(), settings.INVOICE_LANGUAGE}
+    items = (
+        OrderItem.objects
+        .select_related('product')
+        .prefetch_related(Prefetch(
+            'product__translations',
+            queryset=translations_model.objects.filter(language_code__in=languages),
+        ))
+        .order_by('id')
+    )
+    return queryset.select_related('coupon').prefetch_related(Prefetch('items', queryset=items))
+
+
+def get_order(order_id):
+    return with_order_details(Order.objects).get(id=order_id)
+
+
+def build_order_context(order):
+    # totals are stored on the order, no extra pass over the items
+    return {
+        'order': order,
+        'items': order.items.all(),
+        'subtotal': order.subtotal,
+        'discount_amount': order.discount_amount,
+        'total': order.total,
+    }
+
+
+def get_order_context(order_id):
+    order = get_object_or_404(with_order_details(Order.objects), id=order_id)
+    return build_order_context(order)
@@ -1,32 +1,176 @@
 import csv
 import datetime
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.auth import get_user_model
+from django.http import HttpRequest, QueryDict, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from orders.context import with_order_details
+from orders.invoices import iter_invoices_zip
 
 
-def export_to_csv(modeladmin, request, queryset):
-    opts = modeladmin.model._meta
-    content_disposition = (f'attachment; filename={opts.verbose_name}.csv')
+def get_export_url(request, name):
+    return request.build_absolute_uri(reverse('orders:admin_export_download', args=[name]))
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = content_disposition
-    writer = csv.writer(response)
 
-    fields = [
+def get_action_params(request):
+    """
+    Describe with JSON-safe values the objects an admin action runs on, for a
+    Celery task: the changelist filters and, unless every matching object was
+    selected, the primary keys ticked on the page.
+    """
+    selected = None
+    if request.POST.get('select_across') != '1':
+        selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+    return {'user_id': request.user.pk, 'filters': request.GET.urlencode(), 'selected': selected}
+
+
+def get_action_queryset(model, params):
+    # the queryset the action got, rebuilt with the changelist of the user who ran it
+    request = HttpRequest()
+    request.GET = QueryDict(params['filters'])
+    request.user = get_user_model().objects.get(pk=params['user_id'])
+    queryset = admin.site.get_model_admin(model).get_changelist_instance(request).get_queryset(request)
+    if params['selected'] is not None:
+        queryset = queryset.filter(pk__in=params['selected'])
+    return queryset
+
+
+def iter_pk_bounds(queryset, size):
+    """
+    Yield ``(lower, upper)`` primary key bounds splitting ``queryset`` into
+    slices of at most ``size`` rows. ``lower`` is exclusive and ``None`` for
+    the first slice, ``upper`` inclusive and ``None`` for the last one.
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    lower = None
+    while True:
+        page = pks if lower is None else pks.filter(pk__gt=lower)
+        upper = page[size - 1:size].first()
+        yield lower, upper
+        if upper is None:
+            return
+        lower = upper
+
+
+def filter_pk_range(queryset, lower, upper):
+    if lower is not None:
+        queryset = queryset.filter(pk__gt=lower)
+    if upper is not None:
+        queryset = queryset.filter(pk__lte=upper)
+    return queryset.order_by('pk')
+
+
+def iter_pk_ranges(queryset, size):
+    """
+    Yield the querysets of consecutive slices of ``queryset`` holding at most
+    ``size`` rows each, bounded by primary key so each one is an index range.
+    """
+    for lower, upper in iter_pk_bounds(queryset, size):
+        yield filter_pk_range(queryset, lower, upper)
+
+
+class Echo:
+    # csv.writer only needs write(), returning the line lets us yield it
+    def write(self, value):
+        return value
+
+
+def get_export_fields(opts):
+    # columns of the model only, reverse relations such as one-to-ones pointing
+    # at it have no verbose_name
+    return [
             field
             for field in opts.get_fields()
-            if not field.many_to_many and not field.one_to_many
+            if field.concrete and not field.many_to_many
         ]
-    
-    writer.writerow([field.verbose_name for field in fields])
-
-    for obj in queryset:
-        data_row = []
-        for field in fields:
-            value = getattr(obj, field.name)
-            if isinstance(value, datetime.datetime):
-                value = value.strftime('%d/%m/%Y')
-            data_row.append(value)
-        writer.writerow(data_row)
+
+
+def get_export_queryset(queryset, include_items=False):
+    fields = get_export_fields(queryset.model._meta)
+    queryset = queryset.select_related(*[field.name for field in fields if field.many_to_one])
+    if include_items:
+        queryset = queryset.prefetch_related('items__product__translations')
+    return queryset
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        value = value.strftime('%d/%m/%Y')
+    return value
+
+
+def iter_csv_rows(queryset, include_items=False):
+    """
+    Yield the header and one row per object (or per item when
+    ``include_items`` is set), reading the queryset in chunks so memory stays
+    flat whatever the number of rows.
+    """
+    fields = get_export_fields(queryset.model._meta)
+    header = [field.verbose_name for field in fields]
+    if include_items:
+        header += ['product', 'item price', 'item quantity', 'item cost']
+    yield header
+
+    queryset = get_export_queryset(queryset, include_items)
+    for obj in queryset.iterator(chunk_size=settings.CSV_EXPORT_CHUNK_SIZE):
+        data_row = [format_value(getattr(obj, field.name)) for field in fields]
+        if not include_items:
+            yield data_row
+            continue
+        for item in obj.items.all():
+            yield data_row + [item.product, item.price, item.quantity, item.get_cost()]
+
+
+def export(modeladmin, request, queryset, include_items=False):
+    opts = modeladmin.model._meta
+
+    count = queryset.count()
+    if count > settings.CSV_EXPORT_ASYNC_THRESHOLD:
+        from orders.tasks import export_to_csv_file
+        # the changelist filters travel to the worker, not the selected primary keys
+        name = f'{opts.model_name}_{timezone.now():%Y%m%d%H%M%S}.csv'
+        url = get_export_url(request, name)
+        export_to_csv_file.delay(opts.label, get_action_params(request), include_items, request.user.email, name, url)
+        modeladmin.message_user(request, f'The export of {count} rows is running in the background, it will be e-mailed to {request.user.email}.')
+        return None
+
+    content_disposition = (f'attachment; filename={opts.verbose_name}.csv')
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in iter_csv_rows(queryset, include_items)),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = content_disposition
+    return response
+
+
+def export_to_csv(modeladmin, request, queryset):
+    return export(modeladmin, request, queryset)
+
+export_to_csv.short_description = 'Export to CSV'
+
+
+def export_to_csv_with_items(modeladmin, request, queryset):
+    return export(modeladmin, request, queryset, include_items=True)
+
+export_to_csv_with_items.short_description = 'Export to CSV with items'
+
+
+def export_invoices_zip(modeladmin, request, queryset):
+    count = queryset.count()
+    if count > settings.INVOICE_ZIP_ASYNC_THRESHOLD:
+        from orders.tasks import export_invoices_zip_file
+        name = f'invoices_{timezone.now():%Y%m%d%H%M%S}.zip'
+        url = get_export_url(request, name)
+        export_invoices_zip_file.delay(get_action_params(request), request.user.email, name, url)
+        modeladmin.message_user(request, f'The {count} invoices are being generated in the background, the download link will be e-mailed to {request.user.email}.')
+        return None
+
+    response = StreamingHttpResponse(iter_invoices_zip(with_order_details(queryset)), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=invoices.zip'
     return response
 
-export_to_csv.short_description = 'Export to CSV'
\ No newline at end of file
+export_invoices_zip.short_description = 'Download invoices (ZIP)'
@@ -1,22 +1,31 @@
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import get_object_or_404, redirect, render
+from orders.context import get_order_context, with_order_details
 from orders.models import Order
-import weasyprint
-from django.contrib.staticfiles import finders
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from orders.invoices import get_invoice, get_invoice_version
+from django.conf import settings
+from core.media import serve_file
+from django.utils.cache import get_conditional_response
 
 @staff_member_required
 def admin_order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    return render(request, 'admin/orders/order/detail.html', {'order': order})
+    return render(request, 'admin/orders/order/detail.html', get_order_context(order_id))
 
 
 @staff_member_required
 def admin_order_pdf(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    html = render_to_string('orders/order/pdf.html', {'order': order})
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename=order_{order.id}.pdf'
-    weasyprint.HTML(string=html).write_pdf(response, stylesheets=[weasyprint.CSS(finders.find('css/pdf.css'))])
-    return response
\ No newline at end of file
+    order = get_object_or_404(with_order_details(Order.objects), id=order_id)
+    version = get_invoice_version(order)
+    etag = f'"{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    name = get_invoice(order, version)
+    return serve_file(request, settings.INVOICE_STORAGE, name, content_type='application/pdf',
+                      filename=f'order_{order.id}.pdf', etag=etag)
+
+
+@staff_member_required
+def admin_export_download(request, name):
+    return serve_file(request, settings.EXPORT_STORAGE, name, as_attachment=True)
\ No newline at end of file
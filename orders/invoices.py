@@ -0,0 +1,129 @@
+import hashlib
+import zipfile
+from collections import deque
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.template.loader import render_to_string
+from django.utils import translation
+from orders import rendering
+from orders.context import build_order_context
+
+
+def get_invoice_storage():
+    return storages[settings.INVOICE_STORAGE]
+
+
+def get_invoice_version(order):
+    # changes whenever the order or any of its items change, uses the
+    # prefetched items when there are some. Invoices are always rendered in
+    # INVOICE_LANGUAGE, so the active language does not matter
+    items = sorted((item.id, item.product_id, item.price, item.quantity) for item in order.items.all())
+    raw = f"{order.updated.isoformat()}|{order.paid}|{order.discount}|{items}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def get_invoice_name(order, version):
+    # one directory per order, replacing a version only lists that order's files
+    return f"order_{order.id}/{version}.pdf"
+
+
+def render_invoice_html(order):
+    language_code = settings.INVOICE_LANGUAGE
+    with translation.override(language_code):
+        # the products were loaded in the language active at the time
+        for item in order.items.all():
+            item.product.set_current_language(language_code)
+        return render_to_string('orders/order/pdf.html', build_order_context(order))
+
+
+def render_invoice(order):
+    return rendering.render(render_invoice_html(order))
+
+
+def store_invoice(order, name, pdf):
+    storage = get_invoice_storage()
+    storage.save(name, ContentFile(pdf))
+    directory, filename = name.rsplit('/', 1)
+    for old_filename in storage.listdir(directory)[1]:
+        if old_filename != filename:
+            storage.delete(f"{directory}/{old_filename}")
+
+
+def get_invoice(order, version=None):
+    """
+    Return the storage name of the invoice PDF for the current version of
+    ``order``, rendering it only if this version was never stored.
+    """
+    name = get_invoice_name(order, version or get_invoice_version(order))
+    if not get_invoice_storage().exists(name):
+        store_invoice(order, name, render_invoice(order))
+    return name
+
+
+def read_invoice(order):
+    with get_invoice_storage().open(get_invoice(order), 'rb') as f:
+        return f.read()
+
+
+def iter_invoices(orders):
+    """
+    Yield ``(filename, pdf)`` for every order, in order.
+
+    Invoices that are not stored yet are rendered in parallel on the warm
+    rendering pool, at most INVOICE_RENDER_QUEUE_SIZE ahead of the consumer.
+    """
+    storage = get_invoice_storage()
+    pending = deque()
+
+    def finish(order, name, future):
+        if future is None:
+            with storage.open(name, 'rb') as f:
+                pdf = f.read()
+        else:
+            pdf = future.result()
+            store_invoice(order, name, pdf)
+        return f"order_{order.id}.pdf", pdf
+
+    for order in orders:
+        name = get_invoice_name(order, get_invoice_version(order))
+        future = None
+        if not storage.exists(name):
+            future = rendering.submit(render_invoice_html(order))
+        pending.append((order, name, future))
+        if len(pending) >= settings.INVOICE_RENDER_QUEUE_SIZE:
+            yield finish(*pending.popleft())
+    while pending:
+        yield finish(*pending.popleft())
+
+
+class ZipStream:
+    # write-only sink, zipfile falls back to data descriptors when it cannot seek
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_invoices_zip(orders):
+    """
+    Yield a ZIP archive of the invoices of ``orders`` chunk by chunk, never
+    holding more than the INVOICE_RENDER_QUEUE_SIZE PDFs rendered ahead in
+    memory.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, pdf in iter_invoices(orders):
+            archive.writestr(filename, pdf)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,42 @@
+"""
+Django management command to store subtotal, discount and total on existing orders.
+
+Usage: uv run python manage.py backfill_order_totals
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Compute and store the denormalized totals of existing orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders updated per query')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = (
+            Order.objects
+            .annotate(items_subtotal=Sum(F('items__price') * F('items__quantity')))
+            .only('id', 'discount')
+            .order_by('id')
+        )
+
+        batch = []
+        updated = 0
+        for order in orders.iterator(chunk_size=batch_size):
+            order.set_totals(order.items_subtotal)
+            batch.append(order)
+            if len(batch) >= batch_size:
+                updated += self.flush(batch)
+        updated += self.flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated totals for {updated} orders'))
+
+    def flush(self, batch):
+        count = len(batch)
+        Order.objects.bulk_update(batch, ['subtotal', 'discount_amount', 'total'])
+        batch.clear()
+        return count
@@ -0,0 +1,101 @@
+"""
+Django management command to measure invoice rendering: the latency of a
+cold process, of a render that parses the stylesheets again (the behaviour
+before the warm pool) and of a warm worker, then invoices per second with
+warm pools of increasing size.
+
+Renders the invoices of the latest orders, run populate_data first on an
+empty database.
+
+Usage: uv run python manage.py benchmark_invoice_rendering --orders 100 --workers 1 2 4 8
+"""
+
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+
+
+def setup_worker(stylesheet_paths=None):
+    django.setup()
+    if stylesheet_paths is not None:
+        from orders import rendering
+        rendering.warm_up(stylesheet_paths)
+
+
+def render_warm(html):
+    from orders import rendering
+    return len(rendering.render_pdf(html))
+
+
+def render_uncached(html, stylesheet_paths):
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    font_config = FontConfiguration()
+    stylesheets = [weasyprint.CSS(filename=path, font_config=font_config) for path in stylesheet_paths]
+    return len(weasyprint.HTML(string=html).write_pdf(stylesheets=stylesheets, font_config=font_config))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark cold and warm invoice rendering and the throughput of the warm pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100, help='Invoices rendered by every throughput run')
+        parser.add_argument('--workers', type=int, nargs='+', default=None, help='Pool sizes to measure, 1 to the CPU count by default')
+        parser.add_argument('--runs', type=int, default=5, help='Renders timed for every latency')
+
+    def handle(self, *args, **options):
+        # imported here, spawned workers import this module before django.setup()
+        from orders.context import with_order_details
+        from orders.invoices import render_invoice_html
+        from orders.models import Order
+
+        orders = with_order_details(Order.objects.order_by('-id'))[:options['orders']]
+        htmls = [render_invoice_html(order) for order in orders]
+        if not htmls:
+            raise CommandError('No orders to render, run populate_data first')
+        stylesheet_paths = [finders.find(path) for path in settings.INVOICE_STYLESHEETS]
+        # spawned workers import WeasyPrint themselves, like a fresh web or Celery process
+        context = multiprocessing.get_context('spawn')
+        runs = options['runs']
+
+        cold = []
+        for i in range(runs):
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=setup_worker) as executor:
+                executor.submit(render_warm, htmls[i % len(htmls)]).result()
+            cold.append(time.perf_counter() - start)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=setup_worker,
+                                 initargs=(stylesheet_paths,)) as executor:
+            executor.submit(render_warm, htmls[0]).result()
+            uncached = self.time_renders(executor, render_uncached, htmls, runs, stylesheet_paths)
+            warm = self.time_renders(executor, render_warm, htmls, runs)
+
+        for label, timings in [('Cold process', cold), ('Stylesheets parsed per render', uncached), ('Warm worker', warm)]:
+            self.stdout.write(f'{label:<30} {statistics.median(timings) * 1000:8.1f} ms median')
+
+        for workers in options['workers'] or range(1, (os.cpu_count() or 1) + 1):
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=setup_worker,
+                                     initargs=(stylesheet_paths,)) as executor:
+                # start and warm every process before timing
+                for future in [executor.submit(render_warm, htmls[0]) for _ in range(workers)]:
+                    future.result()
+                start = time.perf_counter()
+                for future in [executor.submit(render_warm, html) for html in htmls]:
+                    future.result()
+                elapsed = time.perf_counter() - start
+            self.stdout.write(f'{workers:>3} warm workers {len(htmls) / elapsed:8.1f} invoices/s')
+
+    def time_renders(self, executor, func, htmls, runs, *args):
+        timings = []
+        for i in range(runs):
+            start = time.perf_counter()
+            executor.submit(func, htmls[i % len(htmls)], *args).result()
+            timings.append(time.perf_counter() - start)
+        return timings
@@ -1,6 +1,7 @@
 from django.db import models
+from django.db.models import F, Sum
 from django.conf import settings
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.core.validators import MinValueValidator, MaxValueValidator
 from coupons.models import Coupon
 from django.utils.translation import gettext_lazy as _
@@ -22,6 +23,11 @@ class Order(models.Model):
     coupon = models.ForeignKey(Coupon, related_name='orders', null=True, blank=True, on_delete=models.SET_NULL)
     discount = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
 
+    # denormalized from the items, kept in sync by update_totals()
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+
     class Meta:
         ordering = ('-created',)
         indexes = [models.Index(fields=['-created'])]
@@ -29,18 +35,31 @@ class Order(models.Model):
     def __str__(self):
         return f'Order {self.id}'
     
+    def set_totals(self, subtotal):
+        self.subtotal = subtotal or Decimal(0)
+        self.discount_amount = (self.subtotal * (self.discount / Decimal(100))).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        self.total = self.subtotal - self.discount_amount
+
+    def update_totals(self, items=None):
+        """
+        Recompute and store the totals, from ``items`` if they are already in
+        memory, otherwise with a single aggregate query.
+        """
+        if items is not None:
+            subtotal = sum(item.get_cost() for item in items)
+        else:
+            subtotal = self.items.aggregate(subtotal=Sum(F('price') * F('quantity')))['subtotal']
+        self.set_totals(subtotal)
+        self.save(update_fields=['subtotal', 'discount_amount', 'total'])
+
     def get_total_cost_before_discount(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.subtotal
     
     def get_discount(self):
-        total_cost = self.get_total_cost_before_discount()
-        if self.discount:
-            return total_cost * (self.discount / Decimal(100))
-        return Decimal(0)
+        return self.discount_amount
     
     def get_total_cost(self):
-        total_cost = self.get_total_cost_before_discount()
-        return total_cost - self.get_discount()
+        return self.total
     
     def get_stripe_url(self):
         if not self.stripe_id:
@@ -0,0 +1,78 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+# Parsed once per process and reused for every invoice
+_font_config = None
+_stylesheets = None
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings.INVOICE_RENDER_QUEUE_SIZE)
+
+
+def warm_up(stylesheet_paths=None):
+    global _font_config, _stylesheets
+    if _stylesheets is None:
+        if stylesheet_paths is None:
+            stylesheet_paths = [finders.find(path) for path in settings.INVOICE_STYLESHEETS]
+        _font_config = FontConfiguration()
+        _stylesheets = [weasyprint.CSS(filename=path, font_config=_font_config) for path in stylesheet_paths]
+
+
+def render_pdf(html):
+    warm_up()
+    return weasyprint.HTML(string=html).write_pdf(stylesheets=_stylesheets, font_config=_font_config)
+
+
+def get_executor():
+    """
+    Long-lived pool of warm rendering processes, ``None`` when disabled or when
+    running inside a daemonic process (Celery prefork children) that cannot
+    have children of its own, those render in-process and large archives are
+    spread over several tasks instead.
+    """
+    global _executor
+    if not settings.INVOICE_RENDER_WORKERS or multiprocessing.current_process().daemon:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            stylesheet_paths = [finders.find(path) for path in settings.INVOICE_STYLESHEETS]
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.INVOICE_RENDER_WORKERS,
+                initializer=warm_up,
+                initargs=(stylesheet_paths,),
+            )
+    return _executor
+
+
+def submit(html):
+    """
+    Queue ``html`` for rendering and return a Future with the PDF bytes, blocks
+    while INVOICE_RENDER_QUEUE_SIZE jobs are already waiting.
+    """
+    executor = get_executor()
+    if executor is None:
+        future = Future()
+        try:
+            future.set_result(render_pdf(html))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    _slots.acquire()
+    try:
+        future = executor.submit(render_pdf, html)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda f: _slots.release())
+    return future
+
+
+def render(html):
+    return submit(html).result()
@@ -0,0 +1,47 @@
+from django.db import transaction
+from orders.models import OrderItem
+from orders.tasks import order_created
+from shop.inventory import reserve_stock
+from shop.models import Product
+
+
+class EmptyOrder(Exception):
+    pass
+
+
+def place_order(order, lines, coupon=None):
+    """
+    Save ``order`` with one OrderItem per ``(product_id, quantity)`` line.
+
+    Prices are snapshotted from a single product query and all items are
+    written with one bulk insert in the same transaction, the confirmation
+    e-mail is only queued once the transaction commits. Stock is reserved in
+    the same transaction, raises ``InsufficientStock`` if any product runs out
+    and ``EmptyOrder`` if no line is for an existing product.
+    """
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + quantity
+
+    if coupon:
+        order.coupon = coupon
+        order.discount = coupon.discount
+
+    with transaction.atomic():
+        products = Product.objects.only('id', 'price').in_bulk(quantities.keys())
+        if not products:
+            raise EmptyOrder('Your cart is empty.')
+        items = [
+            OrderItem(product=product, price=product.price, quantity=quantities[product.id])
+            for product in products.values()
+        ]
+        # the totals are known before the order is inserted, it is saved once
+        order.set_totals(sum(item.get_cost() for item in items))
+        order.save()
+        reserve_stock(order, {product_id: quantities[product_id] for product_id in products})
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        transaction.on_commit(lambda: order_created.delay(order.id))
+
+    return order
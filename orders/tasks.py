@@ -1,7 +1,17 @@
-from celery import shared_task
-from django.core.mail import send_mail
+import csv
+import tempfile
+from celery import chord, shared_task
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.mail import EmailMessage, send_mail
 
+from orders.custom_actions import filter_pk_range, get_action_queryset, iter_csv_rows, iter_pk_bounds, iter_pk_ranges
+from orders.context import with_order_details
+from orders.invoices import get_invoice, iter_invoices_zip
 from orders.models import Order
+from mailer.outbox import enqueue
 
 @shared_task
 def order_created(order_id):
@@ -13,7 +23,62 @@ def order_created(order_id):
     f'You have successfully placed an order.'
     f'Your order ID is {order.id}.'
     )
-    mail_sent = send_mail(
-    subject, message, 'admin@myshop.com', [order.email]
-    )
-    return mail_sent
\ No newline at end of file
+    enqueue(EmailMessage(subject, message, 'admin@myshop.com', [order.email]))
+
+
+@shared_task
+def export_to_csv_file(model_label, params, include_items, email, name, url):
+    model = apps.get_model(model_label)
+    queryset = get_action_queryset(model, params)
+    count = 0
+
+    with tempfile.TemporaryFile('w+', newline='') as f:
+        writer = csv.writer(f)
+        for index, chunk in enumerate(iter_pk_ranges(queryset, settings.CSV_EXPORT_CHUNK_SIZE)):
+            rows = iter_csv_rows(chunk, include_items)
+            header = next(rows)
+            if index == 0:
+                writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        f.seek(0)
+        storages[settings.EXPORT_STORAGE].save(name, File(f))
+
+    subject = f'{model._meta.verbose_name_plural.capitalize()} export'
+    message = f'Your export of {count} rows is ready: {url}'
+    return send_mail(subject, message, 'admin@myshop.com', [email])
+
+
+@shared_task
+def export_invoices_zip_file(params, email, name, url):
+    # Celery children cannot start the rendering pool, the invoices are
+    # rendered by one task per pk range instead and zipped once all are stored
+    orders = get_action_queryset(Order, params)
+    render_chunks = [
+        render_invoices.si(params, lower, upper)
+        for lower, upper in iter_pk_bounds(orders, settings.INVOICE_RENDER_CHUNK_SIZE)
+    ]
+    chord(render_chunks)(build_invoices_zip.si(params, email, name, url))
+
+
+@shared_task(ignore_result=False)
+def render_invoices(params, lower, upper):
+    orders = filter_pk_range(get_action_queryset(Order, params), lower, upper)
+    for order in with_order_details(orders).iterator(chunk_size=100):
+        get_invoice(order)
+
+
+@shared_task
+def build_invoices_zip(params, email, name, url):
+    orders = with_order_details(get_action_queryset(Order, params).order_by('pk'))
+    count = orders.count()
+    with tempfile.TemporaryFile() as f:
+        for chunk in iter_invoices_zip(orders.iterator(chunk_size=100)):
+            f.write(chunk)
+        f.seek(0)
+        storages[settings.EXPORT_STORAGE].save(name, File(f))
+
+    subject = 'Invoices export'
+    message = f'The {count} invoices you requested are ready: {url}'
+    return send_mail(subject, message, 'admin@myshop.com', [email])
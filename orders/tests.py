@@ -1,3 +1,283 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+import zipfile
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.storage import storages
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import translation
+from core.celery import app as celery_app
+from orders.admin import OrderAdmin
+from orders.context import get_order
+from orders import invoices
+from orders.custom_actions import export_to_csv, export_to_csv_with_items, iter_pk_ranges
+from orders.models import Order, OrderItem
+from orders.services import EmptyOrder, place_order
+from payment.checkout import get_session_data
+from payment.models import PreparedCheckout
+from shop.models import Category, Product
 
-# Create your tests here.
+
+def create_order(item_count=1):
+    category = Category.objects.language('en').create(name='Tea', slug=f'tea-{Category.objects.count()}')
+    order = Order.objects.create(
+        first_name='Ada', last_name='Lovelace', email='ada@example.com',
+        address='1 Street', postal_code='1000', city='London',
+    )
+    items = []
+    for i in range(item_count):
+        product = Product.objects.language('en').create(
+            category=category, name=f'Tea {i}', slug=f'tea-{i}', price=Decimal('10.00'),
+        )
+        items.append(OrderItem(order=order, product=product, price=product.price, quantity=2))
+    order.update_totals(OrderItem.objects.bulk_create(items))
+    return order
+
+
+def read_csv(response):
+    return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.order = create_order(item_count=2)
+        # the reverse one-to-one must not end up among the exported columns
+        PreparedCheckout.objects.create(order=self.order, session_data={})
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.request = RequestFactory().post('/')
+        self.request.user = self.user
+        self.modeladmin = OrderAdmin(Order, admin.site)
+
+    def test_export_to_csv(self):
+        rows = read_csv(export_to_csv(self.modeladmin, self.request, Order.objects.all()))
+        self.assertEqual(len(rows), 2)
+        self.assertIn('first_name', rows[0])
+        self.assertNotIn('prepared_checkout', rows[0])
+        self.assertEqual(rows[1][0], str(self.order.id))
+
+    def test_export_to_csv_with_items(self):
+        rows = read_csv(export_to_csv_with_items(self.modeladmin, self.request, Order.objects.all()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][-4:], ['product', 'item price', 'item quantity', 'item cost'])
+
+    def export_in_background(self, data, filters=''):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        exports = {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location.name}}
+        self.client.force_login(self.user)
+
+        from orders.tasks import export_to_csv_file
+        with override_settings(STORAGES={**settings.STORAGES, 'exports': exports}), \
+                mock.patch.object(export_to_csv_file, 'delay', side_effect=export_to_csv_file):
+            response = self.client.post(reverse('admin:orders_order_changelist') + filters, {'action': 'export_to_csv', 'index': 0, **data})
+            self.assertEqual(response.status_code, 302)
+            # the task gets JSON-safe filters, not a pickled query or every primary key
+            params = export_to_csv_file.delay.call_args.args[1]
+            self.assertEqual(json.loads(json.dumps(params)), params)
+            name = export_to_csv_file.delay.call_args.args[4]
+            with storages['exports'].open(name, 'r') as f:
+                return list(csv.reader(f))
+
+    @override_settings(CSV_EXPORT_ASYNC_THRESHOLD=0, CSV_EXPORT_CHUNK_SIZE=2)
+    def test_export_to_csv_file(self):
+        orders = [self.order] + [create_order() for _ in range(4)]
+        Order.objects.filter(id=orders[2].id).update(paid=True)
+        rows = self.export_in_background(
+            {'select_across': '1', helpers.ACTION_CHECKBOX_NAME: [self.order.id]}, filters='?paid__exact=0',
+        )
+        self.assertEqual([int(row[0]) for row in rows[1:]], [order.id for order in orders if order != orders[2]])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('4 rows', mail.outbox[0].body)
+
+    @override_settings(CSV_EXPORT_ASYNC_THRESHOLD=0)
+    def test_export_to_csv_file_selected(self):
+        orders = [self.order] + [create_order() for _ in range(3)]
+        rows = self.export_in_background({'select_across': '0', helpers.ACTION_CHECKBOX_NAME: [orders[1].id, orders[3].id]})
+        self.assertEqual([int(row[0]) for row in rows[1:]], [orders[1].id, orders[3].id])
+
+    def test_iter_pk_ranges(self):
+        ids = [self.order.id] + [create_order().id for _ in range(4)]
+        chunks = [list(chunk.values_list('id', flat=True)) for chunk in iter_pk_ranges(Order.objects.all(), 2)]
+        self.assertEqual(chunks, [ids[0:2], ids[2:4], ids[4:]])
+
+
+class InvoiceStorageTests(TestCase):
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        invoice_storage = {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': location.name, 'allow_overwrite': True},
+        }
+        storages_override = override_settings(STORAGES={**settings.STORAGES, 'invoices': invoice_storage})
+        storages_override.enable()
+        self.addCleanup(storages_override.disable)
+        render = mock.patch('orders.invoices.rendering.render', return_value=b'%PDF')
+        render.start()
+        self.addCleanup(render.stop)
+
+    def test_new_version_replaces_only_this_order(self):
+        order, other = create_order(), create_order()
+        other_name = invoices.get_invoice(other)
+        first_name = invoices.get_invoice(order)
+
+        order.discount = 10
+        order.save()
+        second_name = invoices.get_invoice(order)
+
+        storage = invoices.get_invoice_storage()
+        self.assertNotEqual(first_name, second_name)
+        self.assertEqual(storage.listdir(f'order_{order.id}')[1], [second_name.rsplit('/', 1)[1]])
+        self.assertTrue(storage.exists(other_name))
+
+    def test_stored_version_is_not_rendered_again(self):
+        order = create_order()
+        name = invoices.get_invoice(order)
+        self.assertEqual(invoices.get_invoice(order), name)
+        invoices.rendering.render.assert_called_once()
+
+    def test_invoice_is_in_the_invoice_language(self):
+        order = create_order()
+        product = order.items.get().product
+        product.set_current_language('es')
+        product.name = 'Té 0'
+        product.save()
+
+        with translation.override('es'):
+            es_order = get_order(order.id)
+            self.assertEqual(es_order.items.all()[0].product.name, 'Té 0')
+            name = invoices.get_invoice(es_order)
+            with self.assertNumQueries(0):
+                html = invoices.render_invoice_html(es_order)
+        self.assertIn('<td>Tea 0</td>', html)
+        self.assertIn(order.created.strftime('%b'), html)
+
+        # the same stored invoice whatever language it is asked for in
+        self.assertEqual(invoices.get_invoice(get_order(order.id)), name)
+        invoices.rendering.render.assert_called_once()
+
+
+@override_settings(INVOICE_ZIP_ASYNC_THRESHOLD=0, INVOICE_RENDER_CHUNK_SIZE=2)
+class InvoiceZipExportTests(TestCase):
+    def setUp(self):
+        storages_settings = dict(settings.STORAGES)
+        for alias in ('invoices', 'exports'):
+            location = tempfile.TemporaryDirectory()
+            self.addCleanup(location.cleanup)
+            storages_settings[alias] = {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': location.name, 'allow_overwrite': True},
+            }
+        storages_override = override_settings(STORAGES=storages_settings)
+        storages_override.enable()
+        self.addCleanup(storages_override.disable)
+        render = mock.patch('orders.invoices.rendering.render', return_value=b'%PDF')
+        render.start()
+        self.addCleanup(render.stop)
+        # runs the chord and its chunks in-process
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_large_selection_is_rendered_in_chunks(self):
+        orders = [create_order() for _ in range(5)]
+        from orders.tasks import render_invoices
+        with mock.patch.object(render_invoices, 'run', wraps=render_invoices.run) as run:
+            response = self.client.post(reverse('admin:orders_order_changelist'), {
+                'action': 'export_invoices_zip', 'index': 0, 'select_across': '1',
+                helpers.ACTION_CHECKBOX_NAME: [orders[0].id],
+            })
+        self.assertEqual(response.status_code, 302)
+        # 5 orders in chunks of 2, the last range is open ended
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(invoices.rendering.render.call_count, 5)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('The 5 invoices', mail.outbox[0].body)
+        name = storages['exports'].listdir('')[1][0]
+        with storages['exports'].open(name, 'rb') as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(archive.namelist(), [f'order_{order.id}.pdf' for order in orders])
+
+
+@mock.patch('orders.services.order_created')
+class PlaceOrderTests(TestCase):
+    def new_order(self):
+        return Order(first_name='Ada', last_name='Lovelace', email='ada@example.com', address='1 Street', postal_code='1000', city='London')
+
+    def test_order_is_saved_once_with_its_totals(self, order_created):
+        category = Category.objects.language('en').create(name='Tea', slug='tea')
+        products = [
+            Product.objects.language('en').create(category=category, name=f'Tea {i}', slug=f'tea-{i}', price=Decimal('10.00'))
+            for i in range(2)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            order = place_order(self.new_order(), [(products[0].id, 1), (products[1].id, 2), (products[0].id, 1)])
+        order_queries = [query['sql'] for query in queries if '"orders_order"' in query['sql'].split(' SET ')[0]]
+        self.assertEqual(len(order_queries), 1)
+        self.assertTrue(order_queries[0].startswith('INSERT'))
+
+        order = Order.objects.get(id=order.id)
+        self.assertEqual(order.subtotal, Decimal('40.00'))
+        self.assertEqual(order.total, Decimal('40.00'))
+        self.assertEqual(sorted(order.items.values_list('quantity', flat=True)), [2, 2])
+
+    def test_empty_order_is_refused(self, order_created):
+        for lines in ([], [(0, 1)]):
+            with self.subTest(lines=lines), self.assertRaises(EmptyOrder):
+                place_order(self.new_order(), lines)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart_shows_an_error(self, order_created):
+        response = self.client.post(reverse('orders:order_create'), {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+            'address': '1 Street', 'postal_code': '10001', 'city': 'New York',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].non_field_errors(), ['Your cart is empty.'])
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderQueryCountTests(TestCase):
+    # the same number of queries for 1 and 200 items, the items, products and
+    # translations are each loaded with one query
+    item_counts = [1, 200]
+
+    def test_admin_order_detail(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for item_count in self.item_counts:
+            with self.subTest(items=item_count):
+                order = create_order(item_count)
+                url = reverse('orders:admin_order_detail', args=[order.id])
+                # the first request of the session also stores the empty cart in it
+                self.client.get(url)
+                # session, user, order, items and translations
+                with self.assertNumQueries(5):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['items']), item_count)
+
+    def test_render_invoice_html(self):
+        for item_count in self.item_counts:
+            with self.subTest(items=item_count):
+                order = create_order(item_count)
+                with self.assertNumQueries(3):
+                    html = invoices.render_invoice_html(get_order(order.id))
+                self.assertIn(f'Tea {item_count - 1}', html)
+
+    def test_get_session_data(self):
+        for item_count in self.item_counts:
+            with self.subTest(items=item_count):
+                order = create_order(item_count)
+                with self.assertNumQueries(3):
+                    session_data = get_session_data(get_order(order.id), 'https://example.com/done', 'https://example.com/cancel')
+                self.assertEqual(len(session_data['line_items']), item_count)
@@ -1,30 +1,30 @@
+from django.db import transaction
 from django.shortcuts import render, redirect
-from cart.cart import Cart
+from cart.cart import get_cart
 from orders.forms import OrderCreateForm
-from orders.models import OrderItem
-from orders.tasks import order_created
+from orders.services import EmptyOrder, place_order
+from payment.tasks import prepare_checkout
+from payment.views import get_checkout_urls
+from shop.inventory import InsufficientStock
 
 
 def order_create(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if request.method == "POST":
         form = OrderCreateForm(request.POST)
         if form.is_valid():
             order = form.save(commit=False)
-            if cart.coupon:
-                order.coupon = cart.coupon
-                order.discount = cart.coupon.discount
-            order.save()
-            for item in cart:
-                OrderItem.objects.create(
-                    order=order, 
-                    product=item['product'],
-                    price=item['price'],
-                    quantity=item['quantity']
-                    )
+            lines = [(product_id, item['quantity']) for product_id, item in cart.cart.items()]
+            try:
+                place_order(order, lines, coupon=cart.coupon)
+            except (EmptyOrder, InsufficientStock) as e:
+                form.add_error(None, str(e))
+            else:
                 cart.clear()
-                order_created.delay(order.id)
                 request.session['order_id'] = order.id
+                # build the Stripe session parameters before the customer clicks "Pay now"
+                urls = get_checkout_urls(request)
+                transaction.on_commit(lambda: prepare_checkout.delay(order.id, *urls))
                 return redirect('payment:process')
     
     else:
@@ -1,3 +1,15 @@
 from django.contrib import admin
-
+from payment.models import StripeCoupon, StripeEvent
 # Register your models here.
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_id', 'type', 'created', 'processed']
+    list_filter = ['type', 'created', 'processed']
+    search_fields = ['event_id']
+
+
+@admin.register(StripeCoupon)
+class StripeCouponAdmin(admin.ModelAdmin):
+    list_display = ['id', 'coupon', 'percent_off', 'stripe_id', 'created']
+    search_fields = ['coupon__code', 'stripe_id']
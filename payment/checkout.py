@@ -0,0 +1,118 @@
+import hashlib
+from decimal import Decimal
+import stripe
+from payment.client import client, timed
+from orders.context import get_order
+from orders.models import OrderItem
+from payment.models import PreparedCheckout, StripeCoupon
+
+
+def get_stripe_coupon_id(coupon, percent_off):
+    """
+    Return the id of the Stripe coupon for ``coupon`` at ``percent_off``,
+    creating it on Stripe the first time only.
+
+    The id is derived from the local coupon, so two checkouts racing to
+    create it end up with the same Stripe coupon.
+    """
+    stripe_coupon = StripeCoupon.objects.filter(coupon=coupon, percent_off=percent_off).first()
+    if stripe_coupon:
+        return stripe_coupon.stripe_id
+
+    stripe_id = f'shop-{coupon.id}-{percent_off}'
+    try:
+        with timed('coupons.create'):
+            client.v1.coupons.create({
+                'id': stripe_id,
+                'name': coupon.code,
+                'percent_off': percent_off,
+                'duration': 'once',
+            })
+    except stripe.InvalidRequestError as e:
+        if e.code != 'resource_already_exists':
+            raise
+    StripeCoupon.objects.get_or_create(coupon=coupon, percent_off=percent_off, defaults={'stripe_id': stripe_id})
+    return stripe_id
+
+
+def get_session_data(order, success_url, cancel_url):
+    # expects the order loaded with orders.context.with_order_details
+    session_data = {
+        "mode": "payment",
+        "client_reference_id": order.id,
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+        "line_items": []
+    }
+
+    for item in order.items.all():
+        session_data['line_items'].append(
+            {
+                "price_data": {
+                    "unit_amount": int(item.price * Decimal("100")),
+                    "currency": "usd",
+                    "product_data": {
+                        "name": item.product.name,
+                    },
+                },
+                "quantity": item.quantity,
+            }
+        )
+
+    if order.coupon:
+        session_data['discounts'] = [{'coupon': get_stripe_coupon_id(order.coupon, order.discount)}]
+    return session_data
+
+
+def create_checkout_session(session_data):
+    with timed('checkout.sessions.create'):
+        return client.v1.checkout.sessions.create(session_data)
+
+
+async def create_checkout_session_async(session_data):
+    with timed('checkout.sessions.create'):
+        return await client.v1.checkout.sessions.create_async(session_data)
+
+
+def get_checkout_version(order, items):
+    # changes whenever the line items or the discount would, ``items`` are
+    # (id, product_id, price, quantity) tuples
+    raw = f"{order.coupon_id}|{order.discount}|{sorted(items)}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def get_item_rows(order_id):
+    return OrderItem.objects.filter(order_id=order_id).values_list('id', 'product_id', 'price', 'quantity')
+
+
+def prepare_checkout(order_id, success_url, cancel_url):
+    order = get_order(order_id)
+    session_data = get_session_data(order, success_url, cancel_url)
+    items = [(item.id, item.product_id, item.price, item.quantity) for item in order.items.all()]
+    PreparedCheckout.objects.update_or_create(order=order, defaults={
+        'session_data': session_data,
+        'version': get_checkout_version(order, items),
+    })
+    return session_data
+
+
+def get_prepared_session_data(order_id):
+    """
+    Return the session parameters prepared for the order, ``None`` if they
+    were never prepared or the order was edited since, for instance its items
+    or discount in the admin.
+    """
+    prepared = PreparedCheckout.objects.select_related('order').filter(order_id=order_id).first()
+    if prepared is None or prepared.version != get_checkout_version(prepared.order, get_item_rows(order_id)):
+        return None
+    return prepared.session_data
+
+
+async def aget_prepared_session_data(order_id):
+    prepared = await PreparedCheckout.objects.select_related('order').filter(order_id=order_id).afirst()
+    if prepared is None:
+        return None
+    items = [item async for item in get_item_rows(order_id)]
+    if prepared.version != get_checkout_version(prepared.order, items):
+        return None
+    return prepared.session_data
@@ -0,0 +1,36 @@
+import logging
+import time
+from contextlib import contextmanager
+import httpx
+import stripe
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+connect_timeout, read_timeout = settings.STRIPE_TIMEOUT
+
+# One client per process: the requests session behind it keeps the TLS
+# connection to Stripe alive between checkouts, the *_async methods go
+# through an httpx pool instead.
+client = stripe.StripeClient(
+    settings.STRIPE_SECRET_KEY,
+    stripe_version=settings.STRIPE_API_VERSION,
+    base_addresses={'api': settings.STRIPE_API_BASE},
+    max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+    http_client=stripe.RequestsClient(
+        timeout=settings.STRIPE_TIMEOUT,
+        async_fallback_client=stripe.HTTPXClient(timeout=httpx.Timeout(read_timeout, connect=connect_timeout)),
+    ),
+)
+
+
+@contextmanager
+def timed(operation):
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info('Stripe %s %s in %.1f ms', operation, 'failed' if failed else 'done', elapsed)
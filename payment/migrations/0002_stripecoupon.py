@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0001_initial'),
+        ('payment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeCoupon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percent_off', models.PositiveIntegerField()),
+                ('stripe_id', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_coupons', to='coupons.coupon')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('coupon', 'percent_off'), name='unique_stripe_coupon')],
+            },
+        ),
+    ]
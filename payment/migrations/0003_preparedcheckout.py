@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_totals'),
+        ('payment', '0002_stripecoupon'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreparedCheckout',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='prepared_checkout', serialize=False, to='orders.order')),
+                ('session_data', models.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0003_preparedcheckout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='preparedcheckout',
+            name='version',
+            field=models.CharField(default='', max_length=16),
+        ),
+    ]
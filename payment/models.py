@@ -1,3 +1,50 @@
 from django.db import models
 
 # Create your models here.
+
+class StripeEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return self.event_id
+
+
+class StripeCoupon(models.Model):
+    """
+    The Stripe coupon created for a local coupon at a given discount, so a
+    checkout never creates the same coupon twice.
+    """
+    coupon = models.ForeignKey('coupons.Coupon', related_name='stripe_coupons', on_delete=models.CASCADE)
+    percent_off = models.PositiveIntegerField()
+    stripe_id = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'percent_off'], name='unique_stripe_coupon'),
+        ]
+
+    def __str__(self):
+        return self.stripe_id
+
+
+class PreparedCheckout(models.Model):
+    """
+    Checkout Session parameters built when the order is placed, so paying
+    only has to send them to Stripe.
+    """
+    order = models.OneToOneField('orders.Order', related_name='prepared_checkout', on_delete=models.CASCADE, primary_key=True)
+    session_data = models.JSONField()
+    # the order the data was built from, see payment.checkout.get_checkout_version
+    version = models.CharField(max_length=16, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Checkout for order {self.order_id}'
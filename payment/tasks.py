@@ -1,24 +1,69 @@
-from io import BytesIO
+import logging
 from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.utils import timezone
 from celery import shared_task
-from django.contrib.staticfiles import finders
-import weasyprint
+from mailer.outbox import enqueue
+from orders.context import get_order
+from orders.invoices import read_invoice
 from orders.models import Order
+from payment import checkout
+from payment.models import StripeEvent
+from shop.inventory import commit_reservations
+from shop.models import Product
+from shop.recommender import Recommender
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
 def payment_completed(order_id):
-    order = Order.objects.get(id=order_id)
+    order = get_order(order_id)
     subject = f'My Shop - Invoice no. {order.id}'
     message = 'Please, find attached the invoice for your recent purchase.'
     email = EmailMessage(subject, message, 'admin@myshop.com', [order.email])
 
-    html = render_to_string('orders/order/pdf.html', {'order': order})
-    out = BytesIO()
-    stylesheets = [weasyprint.CSS(finders.find('css/pdf.css'))]
-    weasyprint.HTML(string=html).write_pdf(out, stylesheets=stylesheets)
-    email.attach(f'order_{order.id}.pdf', out.getvalue(), 'application/pdf')
-    email.send()
+    email.attach(f'order_{order.id}.pdf', read_invoice(order), 'application/pdf')
+    enqueue(email)
+
+
+@shared_task
+def prepare_checkout(order_id, success_url, cancel_url):
+    checkout.prepare_checkout(order_id, success_url, cancel_url)
+
+
+@shared_task
+def process_stripe_event(event_id):
+    with transaction.atomic():
+        event = StripeEvent.objects.select_for_update().get(event_id=event_id)
+        if event.processed:
+            return
+        if event.type == 'checkout.session.completed':
+            handle_checkout_session_completed(event.payload['data']['object'])
+        event.processed = timezone.now()
+        event.save(update_fields=['processed'])
+
+
+def handle_checkout_session_completed(session):
+    if session['mode'] != 'payment' or session['payment_status'] != 'paid':
+        return
+
+    order = Order.objects.select_for_update().filter(id=session['client_reference_id']).first()
+    if order is None:
+        logger.warning('Stripe session %s references unknown order %s', session['id'], session['client_reference_id'])
+        return
+    if order.paid:
+        return
+
+    # mark order as paid
+    order.paid = True
+    order.stripe_id = session['payment_intent']
+    order.save()
+    commit_reservations(order)
 
+    def after_commit():
+        products = Product.objects.filter(id__in=order.items.values('product_id'))
+        Recommender().products_bought(products)
+        payment_completed.delay(order.id)
 
+    transaction.on_commit(after_commit)
@@ -1,3 +1,278 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
+import stripe
+from asgiref.sync import async_to_sync
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from coupons.models import Coupon
+from orders.models import Order, OrderItem
+from orders.services import place_order
+from payment import checkout, views
+from payment.models import StripeCoupon, StripeEvent
+from payment.tasks import process_stripe_event
+from shop.models import Category, Product, StockReservation
 
-# Create your tests here.
+WEBHOOK_SECRET = 'whsec_test'
+
+
+class StripeStub:
+    """
+    Local HTTP server standing in for the Stripe API, it answers coupon and
+    Checkout Session creation and records every request it gets.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.coupons = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                params = {key: values[0] for key, values in parse_qs(body).items()}
+                stub.requests.append((self.path, params))
+                status, data = stub.handle(self.path, params)
+                content = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.client = stripe.StripeClient(
+            'sk_test_stub', base_addresses={'api': self.url}, max_network_retries=0,
+            http_client=stripe.RequestsClient(async_fallback_client=stripe.HTTPXClient()),
+        )
+
+    def handle(self, path, params):
+        if path == '/v1/coupons':
+            if params['id'] in self.coupons:
+                return 400, {'error': {'type': 'invalid_request_error', 'code': 'resource_already_exists',
+                                       'message': 'Coupon already exists.'}}
+            self.coupons[params['id']] = params
+            return 200, {'id': params['id'], 'object': 'coupon', 'percent_off': int(params['percent_off'])}
+        if path == '/v1/checkout/sessions':
+            id = f'cs_test_{len(self.requests)}'
+            return 200, {'id': id, 'object': 'checkout.session', 'url': f'https://checkout.stripe.test/{id}'}
+        return 404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path.'}}
+
+    def paths(self):
+        return [path for path, params in self.requests]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.patcher = mock.patch('payment.checkout.client', self.client)
+        self.patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def use_stripe_stub(test):
+    stub = StripeStub()
+    test.enterContext(stub)
+    return stub
+
+
+def sign(payload, secret=WEBHOOK_SECRET):
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(f'{timestamp}.{payload}', secret)
+    return f't={timestamp},{stripe.WebhookSignature.EXPECTED_SCHEME}={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+@mock.patch('payment.tasks.Recommender')
+@mock.patch('payment.tasks.payment_completed')
+@mock.patch.object(process_stripe_event, 'delay', side_effect=process_stripe_event)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        category = Category.objects.language('en').create(name='Tea', slug='tea')
+        self.product = Product.objects.language('en').create(
+            category=category, name='Green tea', slug='green-tea', price=Decimal('10.00'), stock=5,
+        )
+        self.order = Order(first_name='Ada', last_name='Lovelace', email='ada@example.com',
+                           address='1 Street', postal_code='1000', city='London')
+        with mock.patch('orders.services.order_created'):
+            place_order(self.order, [(self.product.id, 2)])
+        self.payload = json.dumps({
+            'id': 'evt_test',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {
+                'id': 'cs_test',
+                'object': 'checkout.session',
+                'mode': 'payment',
+                'payment_status': 'paid',
+                'client_reference_id': str(self.order.id),
+                'payment_intent': 'pi_test',
+            }},
+        })
+
+    def post(self, payload, signature):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('stripe-webhook'), payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature,
+            )
+
+    def test_duplicate_event_is_processed_once(self, delay, payment_completed, recommender):
+        for _ in range(2):
+            response = self.post(self.payload, sign(self.payload))
+            self.assertEqual(response.status_code, 200)
+
+        # the retry hits the stored, already processed event and is not queued again
+        delay.assert_called_once_with('evt_test')
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertIsNotNone(StripeEvent.objects.get().processed)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.paid)
+        self.assertEqual(self.order.stripe_id, 'pi_test')
+        self.assertEqual(
+            list(self.order.reservations.values_list('status', flat=True)),
+            [StockReservation.Status.COMMITTED],
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        payment_completed.delay.assert_called_once_with(self.order.id)
+        recommender.return_value.products_bought.assert_called_once()
+
+    def test_bad_signature(self, delay, payment_completed, recommender):
+        response = self.post(self.payload, sign(self.payload, secret='whsec_other'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+        delay.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.paid)
+
+
+class StripeCouponTests(TestCase):
+    def setUp(self):
+        self.stripe = use_stripe_stub(self)
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(code='FLASH25', valid_from=now, valid_to=now + timedelta(days=1), discount=25)
+
+    def test_coupon_is_created_once(self):
+        stripe_id = f'shop-{self.coupon.id}-25'
+        self.assertEqual(checkout.get_stripe_coupon_id(self.coupon, 25), stripe_id)
+        self.assertEqual(self.stripe.requests, [('/v1/coupons', {
+            'id': stripe_id, 'name': 'FLASH25', 'percent_off': '25', 'duration': 'once',
+        })])
+        self.assertEqual(StripeCoupon.objects.get().stripe_id, stripe_id)
+
+        # stored, no round trip to Stripe any more
+        self.assertEqual(checkout.get_stripe_coupon_id(self.coupon, 25), stripe_id)
+        self.assertEqual(len(self.stripe.requests), 1)
+
+        # another discount is another Stripe coupon
+        self.assertEqual(checkout.get_stripe_coupon_id(self.coupon, 10), f'shop-{self.coupon.id}-10')
+        self.assertEqual(StripeCoupon.objects.count(), 2)
+
+    def test_coupon_created_by_a_concurrent_checkout(self):
+        # another worker created it on Stripe but has not stored it yet
+        stripe_id = f'shop-{self.coupon.id}-25'
+        self.stripe.coupons[stripe_id] = {}
+        self.assertEqual(checkout.get_stripe_coupon_id(self.coupon, 25), stripe_id)
+        self.assertEqual(StripeCoupon.objects.get().stripe_id, stripe_id)
+
+    def test_other_stripe_errors_are_raised(self):
+        with mock.patch.object(self.stripe, 'handle', return_value=(400, {'error': {
+            'type': 'invalid_request_error', 'code': 'parameter_invalid_integer', 'message': 'Invalid percent_off.',
+        }})):
+            with self.assertRaises(stripe.InvalidRequestError):
+                checkout.get_stripe_coupon_id(self.coupon, 25)
+        self.assertFalse(StripeCoupon.objects.exists())
+
+    def test_session_data_uses_the_stored_coupon(self):
+        category = Category.objects.language('en').create(name='Tea', slug='tea')
+        product = Product.objects.language('en').create(category=category, name='Green tea', slug='green-tea', price=Decimal('10.00'))
+        order = Order(first_name='Ada', last_name='Lovelace', email='ada@example.com', address='1 Street', postal_code='1000', city='London')
+        with mock.patch('orders.services.order_created'):
+            place_order(order, [(product.id, 1)], coupon=self.coupon)
+
+        for _ in range(2):
+            session_data = checkout.get_session_data(checkout.get_order(order.id), 'https://example.com/done', 'https://example.com/cancel')
+        self.assertEqual(session_data['discounts'], [{'coupon': f'shop-{self.coupon.id}-25'}])
+        self.assertEqual(self.stripe.paths(), ['/v1/coupons'])
+
+
+class PreparedCheckoutTests(TestCase):
+    success_url = 'http://testserver/en/payment/completed/'
+    cancel_url = 'http://testserver/en/payment/canceled/'
+
+    def setUp(self):
+        self.stripe = use_stripe_stub(self)
+        category = Category.objects.language('en').create(name='Tea', slug='tea')
+        product = Product.objects.language('en').create(category=category, name='Green tea', slug='green-tea', price=Decimal('10.00'))
+        self.order = Order(first_name='Ada', last_name='Lovelace', email='ada@example.com', address='1 Street', postal_code='1000', city='London')
+        with mock.patch('orders.services.order_created'):
+            place_order(self.order, [(product.id, 2)])
+        get_session_data = mock.patch('payment.views.get_session_data', wraps=checkout.get_session_data)
+        self.get_session_data = get_session_data.start()
+        self.addCleanup(get_session_data.stop)
+
+    def edit_order(self):
+        # what changing the quantity of an item in the admin does
+        OrderItem.objects.filter(order=self.order).update(quantity=5)
+        self.order.update_totals()
+
+    def post(self):
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+        return self.client.post(reverse('payment:process'))
+
+    def post_async(self):
+        request = RequestFactory().post(reverse('payment:process'))
+        request.session = SessionStore()
+        request.session['order_id'] = self.order.id
+        return async_to_sync(views.payment_process_async)(request)
+
+    def assertSessionCreated(self, response, quantity):
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('https://checkout.stripe.test/'))
+        self.assertEqual(self.stripe.paths(), ['/v1/checkout/sessions'])
+        params = self.stripe.requests[0][1]
+        self.assertEqual(params['client_reference_id'], str(self.order.id))
+        self.assertEqual(params['line_items[0][quantity]'], str(quantity))
+
+    def test_prepared_session_data_is_sent(self):
+        checkout.prepare_checkout(self.order.id, self.success_url, self.cancel_url)
+        self.assertSessionCreated(self.post(), quantity=2)
+        self.get_session_data.assert_not_called()
+
+    def test_stale_session_data_is_rebuilt(self):
+        checkout.prepare_checkout(self.order.id, self.success_url, self.cancel_url)
+        self.edit_order()
+        self.assertIsNone(checkout.get_prepared_session_data(self.order.id))
+        self.assertSessionCreated(self.post(), quantity=5)
+        self.get_session_data.assert_called_once()
+
+    def test_async_prepared_session_data_is_sent(self):
+        checkout.prepare_checkout(self.order.id, self.success_url, self.cancel_url)
+        self.assertSessionCreated(self.post_async(), quantity=2)
+        self.get_session_data.assert_not_called()
+
+    def test_async_falls_back_when_not_prepared(self):
+        self.assertSessionCreated(self.post_async(), quantity=2)
+        self.get_session_data.assert_called_once()
+
+    def test_async_falls_back_when_stale(self):
+        checkout.prepare_checkout(self.order.id, self.success_url, self.cancel_url)
+        self.edit_order()
+        self.assertSessionCreated(self.post_async(), quantity=5)
+        self.get_session_data.assert_called_once()
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from payment import views
 from django.utils.translation import gettext_lazy as _  
 
 app_name = "payment"
 
+payment_process = views.payment_process_async if settings.PAYMENT_ASYNC_CHECKOUT else views.payment_process
+
 urlpatterns = [
-    path(_("process/"), views.payment_process, name="process"),
+    path(_("process/"), payment_process, name="process"),
     path(_("completed/"), views.payment_completed, name="completed"),
     path(_("canceled/"), views.payment_canceled, name="canceled"),
 ]
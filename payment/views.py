@@ -1,59 +1,59 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from decimal import Decimal
-import stripe
-from django.conf import settings
 from django.urls import reverse
+from orders.context import with_order_details
 from orders.models import Order
+from payment.checkout import (
+    aget_prepared_session_data,
+    create_checkout_session,
+    create_checkout_session_async,
+    get_prepared_session_data,
+    get_session_data,
+)
 # Create your views here.
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-stripe.api_version = settings.STRIPE_API_VERSION
+
+def get_checkout_urls(request):
+    success_url = request.build_absolute_uri(reverse('payment:completed'))
+    cancel_url = request.build_absolute_uri(reverse('payment:canceled'))
+    return success_url, cancel_url
 
 
 def payment_process(request):
     order_id = request.session.get('order_id')
-    order = get_object_or_404(Order, id=order_id)
 
     if request.method == "POST":
-        success_url = request.build_absolute_uri(reverse('payment:completed'))
-        cancel_url = request.build_absolute_uri(reverse('payment:canceled'))
-
-        session_data = {
-            "mode": "payment",
-            "client_reference_id": order.id,
-            "success_url": success_url,
-            "cancel_url": cancel_url,
-            "line_items": []
-        }
-
-        for item in order.items.all():
-            session_data['line_items'].append(
-                {
-                    "price_data": {
-                        "unit_amount": int(item.price * Decimal("100")),
-                        "currency": "usd",
-                        "product_data": {
-                            "name": item.product.name,
-                        },
-                    },
-                    "quantity": item.quantity,
-                }
-            )
-
-        if order.coupon:
-            stripe_coupon = stripe.Coupon.create(
-                name=order.coupon.code,
-                percent_off=order.coupon.discount,
-                duration="once",
-            )
-            session_data['discounts'] = [{'coupon': stripe_coupon.id}]
-
-        session = stripe.checkout.Session.create(**session_data)
+        # built when the order was placed, unless that task has not run yet
+        session_data = get_prepared_session_data(order_id)
+        if session_data is None:
+            order = get_object_or_404(with_order_details(Order.objects), id=order_id)
+            session_data = get_session_data(order, *get_checkout_urls(request))
+
+        session = create_checkout_session(session_data)
 
         return redirect(session.url, code=303)
     
     else:
+        order = get_object_or_404(with_order_details(Order.objects), id=order_id)
         return render(request, "payment/process.html", locals())
+
+
+async def payment_process_async(request):
+    """
+    payment_process for ASGI servers: the worker is not held while Stripe
+    creates the session, so one process can keep many checkouts in flight.
+    """
+    if request.method != "POST":
+        return await sync_to_async(payment_process)(request)
+
+    order_id = await request.session.aget('order_id')
+    session_data = await aget_prepared_session_data(order_id)
+    if session_data is None:
+        return await sync_to_async(payment_process)(request)
+
+    session = await create_checkout_session_async(session_data)
+
+    return redirect(session.url, code=303)
     
 
 def payment_completed(request):
@@ -1,16 +1,16 @@
+import json
 import stripe
 from django.conf import settings
+from django.db import transaction
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from orders.models import Order
-from payment.tasks import payment_completed
-from shop.models import Product
-from shop.recommender import Recommender
+from payment.models import StripeEvent
+from payment.tasks import process_stripe_event
 
 @csrf_exempt
 def stripe_webhook(request):
     payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     event = None
     
     try:
@@ -21,28 +21,18 @@ def stripe_webhook(request):
         # Invalid payload
         return HttpResponse(status=400)
     
-    except stripe.error.SignatureVerificationError as e:
+    except stripe.SignatureVerificationError as e:
         # Invalid signature
         return HttpResponse(status=400)
     
-    if event.type == 'checkout.session.completed':
-        session = event.data.object
-        if (session.mode == 'payment' and session.payment_status == 'paid'):
-            try:
-                order = Order.objects.get(id=session.client_reference_id)
-            except Order.DoesNotExist:
-                return HttpResponse(status=404)
-            
-            # mark order as paid
-            order.paid = True
-            order.stripe_id = session.payment_intent
-            order.save()
-
-            product_ids = order.items.values_list('product_id')
-            products = Product.objects.filter(id__in=product_ids)
-            r = Recommender()
-            r.products_bought(products)
-
-            payment_completed.delay(order.id)
+    # Acknowledge right away, the work happens in a Celery task. Stripe retries
+    # and duplicates hit the unique event id and are not processed twice.
+    with transaction.atomic():
+        stripe_event, created = StripeEvent.objects.get_or_create(
+            event_id=event.id,
+            defaults={'type': event.type, 'payload': json.loads(payload)},
+        )
+        if not stripe_event.processed:
+            transaction.on_commit(lambda: process_stripe_event.delay(stripe_event.event_id))
     
-    return HttpResponse(status=200)
\ No newline at end of file
+    return HttpResponse(status=200)
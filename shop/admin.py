@@ -1,5 +1,5 @@
 from django.contrib import admin
-from shop.models import Category, Product
+from shop.models import Category, FacetCount, Product, StockReservation
 from parler.admin import TranslatableAdmin  
 # Register your models here.
 
@@ -14,10 +14,23 @@ class CategoryAdmin(TranslatableAdmin):
 
 @admin.register(Product)
 class ProductAdmin(TranslatableAdmin):
-    list_display = ['id', 'name', 'slug', 'price', 'available', 'created', 'updated']
+    list_display = ['id', 'name', 'slug', 'price', 'available', 'stock', 'created', 'updated']
     list_display_links = ['id', 'name', 'slug']
     list_filter = ['available', 'created', 'updated', 'category']
-    list_editable = ['price', 'available']
+    list_editable = ['price', 'available', 'stock']
     
     def get_prepopulated_fields(self, request, obj=None):
-        return {'slug': ('name',)}
\ No newline at end of file
+        return {'slug': ('name',)}
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'product', 'quantity', 'status', 'created', 'expires']
+    list_filter = ['status', 'created', 'expires']
+    raw_id_fields = ['order', 'product']
+
+
+@admin.register(FacetCount)
+class FacetCountAdmin(admin.ModelAdmin):
+    list_display = ['id', 'category', 'price_bucket', 'available', 'count']
+    list_filter = ['available', 'price_bucket', 'category']
@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import shutil
+import time
+import unicodedata
+from pathlib import Path
+from urllib.parse import quote
+import numpy as np
+import redis
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils import translation
+from parler.utils.i18n import get_active_language_choices
+from shop.models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+REBUILD_SCHEDULED_KEY = 'autocomplete:rebuild-scheduled'
+# keys are the normalized name from every word start, truncated to KEY_WIDTH bytes
+KEY_WIDTH = 48
+MAX_KEYS_PER_ITEM = 8
+# prefixes this short match too much of the catalog, their results are precomputed
+SHORT_PREFIX_LENGTH = 2
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def get_names(model, language_code):
+    # {id: (name, slug)} in the language, or its fallback when not translated
+    translations = (
+        model._parler_meta.root_model.objects
+        .filter(language_code__in=get_active_language_choices(language_code))
+        .values_list('master_id', 'language_code', 'name', 'slug')
+    )
+    if model is Product:
+        translations = translations.filter(master__available=True)
+    names = {}
+    for master_id, code, name, slug in translations.iterator(chunk_size=2000):
+        if master_id not in names or code == language_code:
+            names[master_id] = (name, slug)
+    return names
+
+
+URL_PLACEHOLDERS = {'id': '987654321', 'slug': 'url-placeholder-slug'}
+
+
+def get_url_format(viewname, *args):
+    # reverse once with placeholders and turn them into format fields,
+    # instead of reversing once per product
+    url = reverse(viewname, args=[URL_PLACEHOLDERS[arg] for arg in args])
+    for arg in args:
+        url = url.replace(URL_PLACEHOLDERS[arg], '{%s}' % arg)
+    return url
+
+
+def get_entries(language_code, popularity):
+    """
+    Return ``(name, payload, weight)`` for every available product and every
+    category, the payload being the serialized JSON object sent to the client.
+    """
+    entries = []
+    category_weights = {}
+    with translation.override(language_code):
+        product_url = get_url_format('shop:product_detail', 'id', 'slug')
+        category_url = get_url_format('shop:product_list_by_category', 'slug')
+    products = get_names(Product, language_code)
+    categories = dict(Product.objects.filter(available=True).values_list('id', 'category_id').iterator(chunk_size=2000))
+    for product_id, (name, slug) in products.items():
+        weight = popularity.get(product_id, 0)
+        category_id = categories[product_id]
+        category_weights[category_id] = category_weights.get(category_id, 0) + weight
+        url = product_url.format(id=product_id, slug=quote(slug))
+        entries.append((name, {'type': 'product', 'id': product_id, 'name': name, 'url': url}, weight))
+    for category_id, (name, slug) in get_names(Category, language_code).items():
+        url = category_url.format(slug=quote(slug))
+        weight = category_weights.get(category_id, 0)
+        entries.append((name, {'type': 'category', 'id': category_id, 'name': name, 'url': url}, weight))
+    return [(name, json.dumps(payload).encode(), weight) for name, payload, weight in entries]
+
+
+def top_items(key_items, key_weights, lo, hi, limit):
+    # the best ``limit`` distinct items among the keys in [lo, hi), an item
+    # has at most MAX_KEYS_PER_ITEM keys so that many candidates are enough
+    weights = key_weights[lo:hi]
+    candidates = limit * MAX_KEYS_PER_ITEM
+    if len(weights) > candidates:
+        positions = np.argpartition(-weights, candidates)[:candidates]
+    else:
+        positions = np.arange(len(weights))
+    positions = positions[np.lexsort((positions, -weights[positions]))]
+    items = []
+    for item in key_items[lo + positions]:
+        if item not in items:
+            items.append(item)
+            if len(items) == limit:
+                break
+    return items
+
+
+def build_language(path, entries):
+    path.mkdir(parents=True)
+    keys = []
+    for index, (name, _, _) in enumerate(entries):
+        words = normalize(name).split()
+        for start in range(min(len(words), MAX_KEYS_PER_ITEM)):
+            keys.append((' '.join(words[start:]).encode()[:KEY_WIDTH], index))
+    keys.sort()
+
+    key_array = np.array([key for key, _ in keys], dtype=f'S{KEY_WIDTH}')
+    key_items = np.array([index for _, index in keys], dtype=np.int32)
+    weights = np.array([weight for _, _, weight in entries], dtype=np.float32)
+    key_weights = weights[key_items] if len(keys) else np.zeros(0, dtype=np.float32)
+    payloads = [payload for _, payload, _ in entries]
+    offsets = np.zeros(len(payloads) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(payload) for payload in payloads])
+    blob = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+
+    limit = settings.AUTOCOMPLETE_MAX_RESULTS
+    short_keys = sorted({key[:length] for key, _ in keys for length in range(1, SHORT_PREFIX_LENGTH + 1)})
+    short_top = np.full((len(short_keys), limit), -1, dtype=np.int32)
+    for row, prefix in enumerate(short_keys):
+        lo, hi = np.searchsorted(key_array, [prefix, prefix + b'\xff'])
+        items = top_items(key_items, key_weights, lo, hi, limit)
+        short_top[row, :len(items)] = items
+
+    np.save(path / 'keys.npy', key_array)
+    np.save(path / 'key_items.npy', key_items)
+    np.save(path / 'key_weights.npy', key_weights)
+    np.save(path / 'offsets.npy', offsets)
+    np.save(path / 'blob.npy', blob)
+    np.save(path / 'short_keys.npy', np.array(short_keys, dtype=f'S{SHORT_PREFIX_LENGTH}'))
+    np.save(path / 'short_top.npy', short_top)
+
+
+def rebuild():
+    """
+    Write a new snapshot of every language and point CURRENT at it. Workers
+    memory map the arrays, so they all share one copy in the page cache.
+    """
+    from shop.recommender import Recommender
+    directory = Path(settings.AUTOCOMPLETE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    try:
+        popularity = Recommender().get_popularity(Product.objects.filter(available=True).values_list('id', flat=True))
+    except redis.RedisError:
+        logger.warning('Redis unavailable, building autocomplete without popularity', exc_info=True)
+        popularity = {}
+
+    name = str(time.time_ns())
+    for language_code, _ in settings.LANGUAGES:
+        build_language(directory / name / language_code, get_entries(language_code, popularity))
+
+    current = directory / f'CURRENT.{name}'
+    current.write_text(name)
+    os.replace(current, directory / 'CURRENT')
+
+    # the previous snapshot stays for workers that have not switched yet
+    snapshots = sorted(path for path in directory.iterdir() if path.is_dir())
+    for path in snapshots[:-2]:
+        shutil.rmtree(path, ignore_errors=True)
+    return name
+
+
+def schedule_rebuild():
+    from shop.tasks import rebuild_autocomplete
+    delay = settings.AUTOCOMPLETE_REBUILD_DELAY
+    # shared by every process, a batch of edits anywhere schedules one rebuild
+    if caches['shared'].add(REBUILD_SCHEDULED_KEY, True, delay):
+        rebuild_autocomplete.apply_async(countdown=delay)
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.name = path.name
+        self.path = path
+        self.languages = {}
+
+    def get_language(self, language_code):
+        if language_code not in self.languages:
+            path = self.path / language_code
+            if not path.is_dir():
+                return None
+            self.languages[language_code] = {
+                name: np.load(path / f'{name}.npy', mmap_mode='r')
+                for name in ['keys', 'key_items', 'key_weights', 'offsets', 'blob', 'short_keys', 'short_top']
+            }
+        return self.languages[language_code]
+
+
+_snapshot = None
+_checked = 0.0
+
+
+def get_snapshot():
+    global _snapshot, _checked
+    now = time.monotonic()
+    if now - _checked >= settings.AUTOCOMPLETE_RELOAD_INTERVAL:
+        _checked = now
+        directory = Path(settings.AUTOCOMPLETE_DIR)
+        try:
+            name = (directory / 'CURRENT').read_text().strip()
+        except FileNotFoundError:
+            name = None
+        if name and (_snapshot is None or _snapshot.name != name):
+            _snapshot = Snapshot(directory / name)
+    return _snapshot
+
+
+def suggest(text, language_code, limit):
+    """
+    Return the JSON payloads of the ``limit`` most popular products and
+    categories with a word starting with ``text``.
+    """
+    snapshot = get_snapshot()
+    arrays = snapshot.get_language(language_code) if snapshot else None
+    prefix = normalize(text).encode()[:KEY_WIDTH - 1]
+    if arrays is None or not prefix:
+        return []
+
+    limit = min(limit, settings.AUTOCOMPLETE_MAX_RESULTS)
+    if len(prefix) <= SHORT_PREFIX_LENGTH:
+        short_keys = arrays['short_keys']
+        row = np.searchsorted(short_keys, prefix)
+        if row == len(short_keys) or short_keys[row] != prefix:
+            return []
+        items = [item for item in arrays['short_top'][row][:limit] if item >= 0]
+    else:
+        lo, hi = np.searchsorted(arrays['keys'], [prefix, prefix + b'\xff'])
+        items = top_items(arrays['key_items'], arrays['key_weights'], lo, hi, limit)
+
+    offsets, blob = arrays['offsets'], arrays['blob']
+    return [blob[offsets[item]:offsets[item + 1]].tobytes() for item in items]
@@ -0,0 +1,131 @@
+from collections import Counter
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from shop.models import FacetCount, Product
+
+AVAILABILITY_CHOICES = [
+    ('available', 'Available'),
+    ('unavailable', 'Sold out'),
+]
+
+
+def get_facet_key(product):
+    return product.category_id, product.price_bucket, product.available
+
+
+def adjust(key, delta):
+    category_id, price_bucket, available = key
+    counts = FacetCount.objects.filter(category_id=category_id, price_bucket=price_bucket, available=available)
+    # nothing to decrement when the row is gone, e.g. its category is being deleted
+    if counts.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            FacetCount.objects.create(category_id=category_id, price_bucket=price_bucket, available=available, count=delta)
+    except IntegrityError:
+        # created by a concurrent save in the meantime
+        counts.update(count=F('count') + delta)
+
+
+def move(old_key, new_key):
+    if old_key != new_key:
+        if old_key is not None:
+            adjust(old_key, -1)
+        if new_key is not None:
+            adjust(new_key, 1)
+
+
+def update_price_buckets():
+    # one UPDATE per bucket, for prices changed without Product.save()
+    bounds = [None, *settings.SHOP_PRICE_BUCKETS, None]
+    for bucket, (low, high) in enumerate(zip(bounds, bounds[1:])):
+        products = Product.objects.exclude(price_bucket=bucket)
+        if low is not None:
+            products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+        products.update(price_bucket=bucket)
+
+
+def rebuild():
+    update_price_buckets()
+    rows = Product.objects.order_by().values('category_id', 'price_bucket', 'available').annotate(count=Count('id'))
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create([FacetCount(**row) for row in rows])
+
+
+def get_price_labels():
+    bounds = settings.SHOP_PRICE_BUCKETS
+    labels = [f'Under ${bounds[0]}']
+    labels += [f'${low} to ${high}' for low, high in zip(bounds, bounds[1:])]
+    labels.append(f'${bounds[-1]} and over')
+    return labels
+
+
+def get_price_buckets(values):
+    buckets = set()
+    for value in values:
+        try:
+            bucket = int(value)
+        except ValueError:
+            continue
+        if 0 <= bucket <= len(settings.SHOP_PRICE_BUCKETS):
+            buckets.add(bucket)
+    return sorted(buckets)
+
+
+def get_counts(category, price_buckets, available):
+    """
+    Count the products of every facet value under the other active filters,
+    from the rollup table alone (one small query whatever the catalog size).
+    """
+    category_counts, price_counts, availability_counts = Counter(), Counter(), Counter()
+    for category_id, price_bucket, is_available, count in FacetCount.objects.filter(count__gt=0).values_list(
+            'category_id', 'price_bucket', 'available', 'count'):
+        in_category = category is None or category_id == category.id
+        in_price = not price_buckets or price_bucket in price_buckets
+        if is_available == available and in_price:
+            category_counts[category_id] += count
+        if is_available == available and in_category:
+            price_counts[price_bucket] += count
+        if in_category and in_price:
+            availability_counts[is_available] += count
+    return category_counts, price_counts, availability_counts
+
+
+def get_filter_query(query):
+    # the active filters without the page position, to carry over to other listings
+    query = query.copy()
+    query.pop('cursor', None)
+    return query
+
+
+def get_price_options(query, price_buckets, counts):
+    options = []
+    for bucket, label in enumerate(get_price_labels()):
+        option_query = get_filter_query(query)
+        option_query.setlist('price', sorted(set(price_buckets) ^ {bucket}))
+        options.append({
+            'label': label,
+            'count': counts[bucket],
+            'selected': bucket in price_buckets,
+            'query': option_query.urlencode(),
+        })
+    return options
+
+
+def get_availability_options(query, available, counts):
+    options = []
+    for value, label in AVAILABILITY_CHOICES:
+        option_query = get_filter_query(query)
+        option_query['availability'] = value
+        is_available = value == 'available'
+        options.append({
+            'label': label,
+            'count': counts[is_available],
+            'selected': is_available == available,
+            'query': option_query.urlencode(),
+        })
+    return options
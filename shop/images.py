@@ -0,0 +1,126 @@
+import hashlib
+import io
+import os
+from PIL import ExifTags, Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# extension: (Pillow format, needs an opaque image)
+FORMATS = {
+    'webp': ('WEBP', False),
+    'jpeg': ('JPEG', True),
+}
+
+
+def get_source_version(name):
+    # changes when the file is overwritten under the same name, from its
+    # modification time and size so the image is not read to check it
+    modified = default_storage.get_modified_time(name).timestamp()
+    return hashlib.sha1(f'{modified}:{default_storage.size(name)}'.encode()).hexdigest()[:8]
+
+
+def get_variant_name(name, version, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}_{version}_{width}w.{extension}'
+
+
+def get_widths(original_width):
+    # never upscale, the largest variant is the original width capped to the largest setting
+    largest = min(original_width, max(settings.PRODUCT_IMAGE_WIDTHS))
+    return sorted({width for width in settings.PRODUCT_IMAGE_WIDTHS if width < largest} | {largest})
+
+
+def is_up_to_date(product, check_source=False):
+    """
+    Whether the variants were made from the current image. Only the name is
+    compared unless ``check_source`` is set, then the file is checked for
+    having been overwritten since, which costs a storage lookup.
+    """
+    name = product.image.name or None
+    if name != product.image_variants.get('source'):
+        return False
+    if check_source and name:
+        try:
+            return get_source_version(name) == product.image_variants.get('version')
+        except FileNotFoundError:
+            # nothing to make variants of
+            return True
+    return True
+
+
+def get_variant_names(variants):
+    return {name for extension in FORMATS for _, name in variants.get(extension, [])}
+
+
+def prepare(image, opaque):
+    if image.mode in ('RGB', 'RGBA'):
+        pass
+    elif 'A' in image.getbands() or 'transparency' in image.info:
+        image = image.convert('RGBA')
+    else:
+        image = image.convert('RGB')
+    if opaque and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    return image
+
+
+def build_variants(name, force=False):
+    """
+    Write WebP and JPEG copies of the image ``name`` at every width next to
+    it and return the description stored in ``Product.image_variants``.
+
+    The variant names carry the version of the source, an overwritten image
+    gets new ones. Variants already in storage are kept unless ``force`` is
+    set, the image is only decoded when at least one of them is missing.
+    """
+    version = get_source_version(name)
+    with default_storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        width, height = image.size
+        if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        variants = {'source': name, 'version': version, 'width': width, 'height': height}
+
+        source = None
+        for extension, (format, opaque) in FORMATS.items():
+            variants[extension] = []
+            prepared = None
+            for variant_width in get_widths(width):
+                variant = get_variant_name(name, version, variant_width, extension)
+                variants[extension].append([variant_width, variant])
+                if not force and default_storage.exists(variant):
+                    continue
+                if source is None:
+                    source = ImageOps.exif_transpose(image)
+                if prepared is None:
+                    prepared = prepare(source, opaque)
+                variant_height = max(1, round(height * variant_width / width))
+                resized = prepared.resize((variant_width, variant_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+                buffer = io.BytesIO()
+                resized.save(buffer, format, quality=settings.PRODUCT_IMAGE_QUALITY, optimize=True)
+                default_storage.delete(variant)
+                default_storage.save(variant, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def save_variants(product_id, name, variants, old_variants):
+    from shop.models import Product
+    # the image may have been replaced while the variants were made
+    if Product.objects.filter(id=product_id, image=name or '').update(image_variants=variants):
+        for stale in get_variant_names(old_variants) - get_variant_names(variants):
+            default_storage.delete(stale)
+
+
+def delete_variants(variants):
+    for name in get_variant_names(variants):
+        default_storage.delete(name)
+
+
+def update_variants(product, force=False):
+    name = product.image.name or None
+    variants = build_variants(name, force) if name else {}
+    save_variants(product.id, name, variants, product.image_variants)
+    return variants
@@ -0,0 +1,94 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+from django.utils import timezone
+from shop.models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def get_quantity(quantities):
+    # the quantity of each product as one SQL expression, for single-statement updates
+    return Case(
+        *[When(id=product_id, then=Value(qty)) for product_id, qty in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+
+
+def take_stock(quantities):
+    """
+    Decrement stock for every ``{product_id: quantity}`` in one conditional
+    UPDATE, returns how many products had enough units.
+
+    The check and the decrement happen in the database, so concurrent
+    checkouts can never push a product below zero. Untracked (NULL) stock
+    always matches and stays NULL.
+    """
+    if not quantities:
+        return 0
+    quantity = get_quantity(quantities)
+    return (
+        Product.objects
+        .filter(id__in=quantities.keys())
+        .filter(Q(stock__isnull=True) | Q(stock__gte=quantity))
+        .update(stock=F('stock') - quantity)
+    )
+
+
+def return_stock(quantities):
+    """
+    Put ``{product_id: quantity}`` back on sale in one UPDATE, returns how many
+    products were updated.
+    """
+    if not quantities:
+        return 0
+    return Product.objects.filter(id__in=quantities.keys()).update(stock=F('stock') + get_quantity(quantities))
+
+
+def reserve_stock(order, quantities):
+    """
+    Reserve ``{product_id: quantity}`` for an unpaid order, must run inside the
+    transaction that creates the order so a shortage rolls everything back.
+    """
+    if take_stock(quantities) != len(quantities):
+        raise InsufficientStock('Not enough stock for some of the products in your cart.')
+
+    expires = timezone.now() + timedelta(seconds=settings.INVENTORY_RESERVATION_TIMEOUT)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires=expires)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def commit_reservations(order):
+    with transaction.atomic():
+        reservations = order.reservations.select_for_update().exclude(status=StockReservation.Status.COMMITTED)
+        for reservation in reservations:
+            if reservation.status == StockReservation.Status.RELEASED:
+                # paid after the reservation expired, the units went back on sale
+                if not take_stock({reservation.product_id: reservation.quantity}):
+                    logger.warning('Order %s was paid after its reservation expired and product %s is oversold',
+                                   order.id, reservation.product_id)
+        reservations.update(status=StockReservation.Status.COMMITTED)
+
+
+def release_expired_reservations(batch_size=500):
+    with transaction.atomic():
+        reservations = list(
+            StockReservation.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(status=StockReservation.Status.RESERVED, expires__lte=timezone.now(), order__paid=False)
+            [:batch_size]
+        )
+        quantities = {}
+        for reservation in reservations:
+            quantities[reservation.product_id] = quantities.get(reservation.product_id, 0) + reservation.quantity
+        return_stock(quantities)
+        StockReservation.objects.filter(id__in=[r.id for r in reservations]).update(status=StockReservation.Status.RELEASED)
+    return len(reservations)
@@ -0,0 +1,77 @@
+"""
+Django management command to measure checkout throughput: parallel
+place_order() calls competing for one product with limited stock, checking
+that no unit is ever oversold.
+
+Creates its own category, product and orders and deletes them at the end,
+the confirmation e-mail task is not queued.
+
+Usage: uv run python manage.py benchmark_checkout --checkouts 500 --stock 200 --threads 1 4 16
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from orders import services
+from orders.models import Order
+from orders.services import place_order
+from shop.inventory import InsufficientStock
+from shop.models import Category, Product
+
+
+class NoTask:
+    # stands in for the order_created task, the benchmark measures the checkout only
+    def delay(self, *args, **kwargs):
+        pass
+
+
+def checkout(product_id):
+    order = Order(first_name='Bench', last_name='Mark', email='benchmark@example.com',
+                  address='1 Street', postal_code='1000', city='City')
+    try:
+        place_order(order, [(product_id, 1)])
+        return True
+    except InsufficientStock:
+        return False
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark parallel checkouts of one product and check nothing is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=500, help='Checkouts attempted by every run')
+        parser.add_argument('--stock', type=int, default=200, help='Units of the product on sale')
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16], help='Concurrent checkouts to measure')
+
+    def handle(self, *args, **options):
+        language = settings.LANGUAGE_CODE
+        order_created = services.order_created
+        services.order_created = NoTask()
+        category = Category.objects.language(language).create(name='Benchmark', slug='benchmark-checkout')
+        try:
+            self.stdout.write(f'{"threads":>8} {"checkouts/s":>12} {"sold":>6} {"sold out":>9}')
+            for threads in options['threads']:
+                product = Product.objects.language(language).create(
+                    category=category, name='Benchmark', slug=f'benchmark-checkout-{threads}',
+                    price=Decimal('10.00'), stock=options['stock'],
+                )
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    results = list(executor.map(checkout, [product.id] * options['checkouts']))
+                elapsed = time.perf_counter() - start
+
+                sold = results.count(True)
+                product.refresh_from_db()
+                if sold != min(options['stock'], options['checkouts']) or product.stock != options['stock'] - sold:
+                    raise CommandError(f'{sold} units sold, {product.stock} left of {options["stock"]}')
+                self.stdout.write(f'{threads:>8} {len(results) / elapsed:>12.1f} {sold:>6} {results.count(False):>9}')
+        finally:
+            services.order_created = order_created
+            Order.objects.filter(items__product__category=category).delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
@@ -0,0 +1,115 @@
+"""
+Django management command to benchmark faceted filtering on a synthetic
+catalog: the FacetCount rollup against per-facet COUNT queries over the
+translations join, filtered listing pages and a full rollup rebuild.
+
+The catalog is created inside a transaction that is rolled back at the end,
+the database is left as it was.
+
+Usage: uv run python manage.py benchmark_facets --products 200000
+"""
+
+import random
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.core.management.base import BaseCommand
+from shop import facets
+from shop.models import Category, Product, get_price_bucket
+from shop.pagination import paginate_products
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark facet counts and filtered product listings on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200000, help='Synthetic products to create')
+        parser.add_argument('--categories', type=int, default=20, help='Synthetic categories to create')
+        parser.add_argument('--runs', type=int, default=20, help='Repetitions of every timed query')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        language = settings.LANGUAGE_CODE
+        start = time.perf_counter()
+        categories = self.create_categories(options['categories'], language)
+        self.create_products(options['products'], categories, language, rng)
+        self.stdout.write(f'Created {options["products"]} products in {time.perf_counter() - start:.1f} s')
+
+        start = time.perf_counter()
+        facets.rebuild()
+        self.stdout.write(f'{"Rollup rebuild":<40} {(time.perf_counter() - start) * 1000:10.1f} ms')
+        if connection.vendor in ('sqlite', 'postgresql'):
+            connection.cursor().execute('ANALYZE')
+
+        category = categories[len(categories) // 2]
+        buckets = [1, 2]
+        runs = options['runs']
+        self.bench('Facet counts, rollup', runs, facets.get_counts, category, buckets, True)
+        self.bench('Facet counts, COUNT queries', max(1, runs // 4), self.count_facets, category, buckets, True, language)
+
+        page_size = settings.SHOP_PAGE_SIZE
+        products = Product.objects.filter(available=True).with_translations(language)
+        self.bench('Page, no filter', runs, self.first_page, products, page_size)
+        self.bench('Page, category', runs, self.first_page, products.filter(category=category), page_size)
+        self.bench('Page, category and 2 price ranges', runs, self.first_page,
+                   products.filter(category=category, price_bucket__in=buckets), page_size)
+        self.bench('Page, most expensive price range', runs, self.first_page,
+                   products.filter(price_bucket__in=[len(settings.SHOP_PRICE_BUCKETS)]), page_size)
+        self.bench('Page, sold out', runs, self.first_page,
+                   Product.objects.filter(available=False).with_translations(language), page_size)
+
+    def create_categories(self, count, language):
+        return [
+            Category.objects.language(language).create(name=f'Benchmark {i}', slug=f'benchmark-{i}')
+            for i in range(count)
+        ]
+
+    def create_products(self, count, categories, language, rng):
+        # bulk inserts skip Product.save() and the signals, the rollup is rebuilt afterwards
+        translations_model = Product._parler_meta.root_model
+        batch_size = 5000
+        for offset in range(0, count, batch_size):
+            products = []
+            for _ in range(min(batch_size, count - offset)):
+                price = Decimal(rng.randint(100, 50000)) / 100
+                products.append(Product(
+                    category=rng.choice(categories), price=price, price_bucket=get_price_bucket(price),
+                    available=rng.random() < 0.9,
+                ))
+            products = Product.objects.bulk_create(products)
+            translations_model.objects.bulk_create([
+                translations_model(master=product, language_code=language, name=f'Product {product.id}', slug=f'product-{product.id}')
+                for product in products
+            ])
+
+    def count_facets(self, category, buckets, available, language):
+        # what the counts would cost without the rollup, one grouped COUNT per facet
+        products = Product.objects.filter(translations__language_code=language)
+        list(products.filter(available=available, price_bucket__in=buckets).values('category').annotate(count=Count('id')))
+        list(products.filter(available=available, category=category).values('price_bucket').annotate(count=Count('id')))
+        list(products.filter(category=category, price_bucket__in=buckets).values('available').annotate(count=Count('id')))
+
+    def first_page(self, products, page_size):
+        page, _ = paginate_products(products, None, page_size)
+        list(page)
+
+    def bench(self, label, runs, func, *args):
+        start = time.perf_counter()
+        for _ in range(runs):
+            func(*args)
+        self.stdout.write(f'{label:<40} {(time.perf_counter() - start) / runs * 1000:10.2f} ms')
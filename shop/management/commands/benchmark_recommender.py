@@ -0,0 +1,126 @@
+"""
+Django management command to compare the Redis round trips and wall time of
+recording co-purchases one ZINCRBY at a time and through
+Recommender.orders_bought.
+
+Runs against fakeredis by default, with --latency simulating the network
+round trip, or against the configured Redis with --redis (it writes to
+temporary keys and deletes them).
+
+Usage: uv run python manage.py benchmark_recommender --sizes 2 10 30 100 --latency 0.2
+"""
+
+import time
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop import recommender
+from shop.recommender import Recommender
+
+
+class BenchmarkRecommender(Recommender):
+    # keys of their own so a run against a real Redis never touches live sets
+    def get_product_key(self, id):
+        return f"benchmark:product:{id}:purchased_with"
+
+
+class RoundTripCounter:
+    """
+    Count the round trips made through ``client`` (one per command, one per
+    pipeline execute) and sleep ``latency`` seconds for each of them.
+    """
+
+    def __init__(self, client, latency):
+        self.client = client
+        self.latency = latency
+        self.round_trips = 0
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_execute_command(*args, **kwargs):
+            self.round_trip()
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*args, **kwargs):
+                if pipe.command_stack:
+                    self.round_trip()
+                return execute(*args, **kwargs)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_execute_command
+        client.pipeline = counted_pipeline
+
+    def round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def products_bought_per_pair(client, product_ids):
+    # the previous implementation, one ZINCRBY round trip per ordered pair
+    rec = BenchmarkRecommender()
+    for product_id in product_ids:
+        for with_id in product_ids:
+            if product_id != with_id:
+                client.zincrby(rec.get_product_key(product_id), 1, with_id)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark co-purchase updates per pair against one pipeline per order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[2, 5, 10, 30, 50, 100], help='Products per order')
+        parser.add_argument('--latency', type=float, default=0.2, help='Simulated round trip in milliseconds')
+        parser.add_argument('--orders', type=int, default=1000, help='Orders recorded by the bulk backfill run')
+        parser.add_argument('--redis', action='store_true', help='Use the configured Redis instead of fakeredis')
+
+    def get_client(self, use_redis):
+        if use_redis:
+            return redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+        import fakeredis
+        return fakeredis.FakeRedis()
+
+    def measure(self, client, latency, func, *args):
+        counter = RoundTripCounter(client, latency)
+        start = time.perf_counter()
+        func(*args)
+        return counter.round_trips, (time.perf_counter() - start) * 1000
+
+    def handle(self, *args, **options):
+        latency = options['latency'] / 1000
+        live_client = recommender.r
+        try:
+            self.stdout.write(f'{"items":>6} {"per pair":>20} {"pipelined":>20} {"speedup":>8}')
+            for size in options['sizes']:
+                product_ids = list(range(1, size + 1))
+                client = self.get_client(options['redis'])
+                pair_trips, pair_ms = self.measure(client, latency, products_bought_per_pair, client, product_ids)
+                self.cleanup(client)
+
+                client = recommender.r = self.get_client(options['redis'])
+                pipe_trips, pipe_ms = self.measure(client, latency, BenchmarkRecommender().orders_bought, [product_ids])
+                self.cleanup(client)
+
+                self.stdout.write(
+                    f'{size:>6} {pair_trips:>6} trips {pair_ms:>7.1f} ms {pipe_trips:>6} trips {pipe_ms:>7.1f} ms '
+                    f'{pair_ms / pipe_ms:>7.1f}x'
+                )
+
+            orders = [[(i * 7 + j) % 500 + 1 for j in range(10)] for i in range(options['orders'])]
+            client = recommender.r = self.get_client(options['redis'])
+            trips, ms = self.measure(client, latency, BenchmarkRecommender().orders_bought, orders)
+            self.cleanup(client)
+            self.stdout.write(f'Backfill of {len(orders)} 10-item orders: {trips} trips, {ms:.1f} ms')
+        finally:
+            recommender.r = live_client
+
+    def cleanup(self, client):
+        keys = list(client.scan_iter(match='benchmark:*'))
+        if keys:
+            client.delete(*keys)
@@ -0,0 +1,57 @@
+"""
+Django management command to generate the resized variants of existing
+product images, in parallel.
+
+Usage: uv run python manage.py generate_image_variants --workers 4
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import django
+from django import db
+from django.core.management.base import BaseCommand
+from shop import images
+from shop.models import Product
+
+
+def process_image(name, force):
+    # runs in a worker process, only touches storage, the database is updated by the parent
+    try:
+        return images.build_variants(name, force), None
+    except Exception as e:
+        return None, repr(e)
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP and JPEG variants of product images that do not have up to date ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate every variant, even up to date ones')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'image_variants')
+        pending = [product for product in products if options['force'] or not images.is_up_to_date(product, check_source=True)]
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('All product images are up to date'))
+            return
+
+        # forked workers must not share the parent's database connections
+        db.connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = {
+                executor.submit(process_image, product.image.name, options['force']): product
+                for product in pending
+            }
+            for future in as_completed(futures):
+                product = futures[future]
+                variants, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Product {product.id} ({product.image.name}): {error}')
+                    continue
+                images.save_variants(product.id, product.image.name, variants, product.image_variants)
+                done += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {done} products, {failed} failed'))
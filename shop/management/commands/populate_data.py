@@ -316,6 +316,7 @@ class Command(BaseCommand):
                     price=product.price,
                     quantity=random.randint(1, 3),
                 )
+            order.update_totals()
             
             orders.append(order)
         
@@ -0,0 +1,18 @@
+"""
+Django management command to recompute the product price buckets and the
+facet counts, e.g. after products were imported with bulk_create.
+
+Usage: uv run python manage.py rebuild_facet_counts
+"""
+
+from django.core.management.base import BaseCommand
+from shop import facets
+from shop.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recompute product price buckets and the facet count rollup'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {FacetCount.objects.count()} facet counts'))
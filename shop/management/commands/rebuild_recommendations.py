@@ -0,0 +1,93 @@
+"""
+Django management command to rebuild the "bought together" recommendations
+from the paid order history.
+
+Usage: uv run python manage.py rebuild_recommendations --top-k 100
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from orders.models import OrderItem
+from shop.models import Product
+from shop.recommender import Recommender
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the co-purchase sorted sets in Redis from paid order items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=settings.RECOMMENDER_MAX_RELATED, help='Related products kept per product')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Order lines read per chunk')
+
+    def handle(self, *args, **options):
+        product_ids = np.fromiter(Product.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        co_purchases = self.count_co_purchases(product_ids, options['chunk_size'])
+        related = self.top_related(product_ids, co_purchases, options['top_k'])
+
+        Recommender().replace_purchases(related)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt recommendations for {len(related)} products from {co_purchases.nnz} product pairs'))
+
+    def count_co_purchases(self, product_ids, chunk_size):
+        """
+        Sum X.T @ X over chunks of the order x product matrix, only one chunk of
+        order lines and the sparse product x product counts are in memory.
+        Every order is weighted by its age with the same half-life the live sets
+        decay with.
+        """
+        now = time.time()
+        n = len(product_ids)
+        co_purchases = sparse.csr_matrix((n, n), dtype=np.float64)
+
+        lines = (
+            OrderItem.objects
+            .filter(order__paid=True)
+            .order_by('order_id')
+            .values_list('order_id', 'product_id', 'order__created')
+            .iterator(chunk_size=chunk_size)
+        )
+        chunk = []
+        for order_id, product_id, created in lines:
+            # only flush between orders so an order is never split across chunks
+            if len(chunk) >= chunk_size and order_id != chunk[-1][0]:
+                co_purchases += self.chunk_co_purchases(product_ids, chunk)
+                chunk = []
+            chunk.append((order_id, product_id, now - created.timestamp()))
+        if chunk:
+            co_purchases += self.chunk_co_purchases(product_ids, chunk)
+
+        co_purchases.setdiag(0)
+        co_purchases.eliminate_zeros()
+        return co_purchases
+
+    def chunk_co_purchases(self, product_ids, chunk):
+        order_ids, line_product_ids, ages = np.array(chunk, dtype=np.float64).T
+        _, rows = np.unique(order_ids, return_inverse=True)
+        columns = np.searchsorted(product_ids, line_product_ids.astype(np.int64))
+        orders = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)),
+            shape=(rows.max() + 1, len(product_ids)),
+        )
+        # an order counts once per pair even if a product appears on two lines,
+        # sqrt so that a pair gets the order weight once in X.T @ X
+        weights = np.zeros(orders.shape[0])
+        weights[rows] = np.sqrt(0.5 ** (ages / settings.RECOMMENDER_DECAY_HALF_LIFE))
+        orders.data = weights[np.repeat(np.arange(orders.shape[0]), np.diff(orders.indptr))]
+        return (orders.T @ orders).tocsr()
+
+    def top_related(self, product_ids, co_purchases, top_k):
+        related = {}
+        for row in range(co_purchases.shape[0]):
+            start, end = co_purchases.indptr[row], co_purchases.indptr[row + 1]
+            columns = co_purchases.indices[start:end]
+            scores = co_purchases.data[start:end]
+            if len(scores) > top_k:
+                best = np.argpartition(scores, -top_k)[-top_k:]
+                columns, scores = columns[best], scores[best]
+            related[int(product_ids[row])] = {
+                int(product_ids[column]): float(score) for column, score in zip(columns, scores)
+            }
+        return related
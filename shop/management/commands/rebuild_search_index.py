@@ -0,0 +1,20 @@
+"""
+Django management command to rebuild the product search index from scratch.
+
+Usage: uv run python manage.py rebuild_search_index
+"""
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-language full-text index of product names and descriptions'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {settings.SEARCH_INDEX_PATH} in {time.perf_counter() - start:.1f}s'))
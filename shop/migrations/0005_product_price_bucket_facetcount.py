@@ -0,0 +1,66 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_facets(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    FacetCount = apps.get_model('shop', 'FacetCount')
+    bounds = [None, *settings.SHOP_PRICE_BUCKETS, None]
+    for bucket, (low, high) in enumerate(zip(bounds, bounds[1:])):
+        products = Product.objects.all()
+        if low is not None:
+            products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+        products.update(price_bucket=bucket)
+    rows = Product.objects.order_by().values('category_id', 'price_bucket', 'available').annotate(count=models.Count('id'))
+    FacetCount.objects.bulk_create([FacetCount(**row) for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_stock_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('available', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_bucket',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created', '-id'], name='shop_produc_categor_6d1074_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price_bucket', '-created', '-id'], name='shop_produc_categor_076835_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_bucket', '-created', '-id'], name='shop_produc_price_b_47a425_idx'),
+        ),
+        migrations.AddField(
+            model_name='facetcount',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'price_bucket', 'available'), name='unique_facet_count'),
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,28 @@
+from bisect import bisect_right
+from django.conf import settings
 from django.db import models
 from django.urls import reverse
+from parler.managers import TranslatableManager, TranslatableQuerySet
 from parler.models import TranslatableModel, TranslatedFields
+from parler.utils.i18n import get_active_language_choices
+
+
+class ShopQuerySet(TranslatableQuerySet):
+    def with_translations(self, language_code=None):
+        # Load the active language (and its fallback) in a single extra query,
+        # parler reads them from the prefetch cache instead of one query per object.
+        translations_model = self.model._parler_meta.root_model
+        languages = get_active_language_choices(language_code)
+        return self.prefetch_related(
+            models.Prefetch(
+                'translations',
+                queryset=translations_model.objects.filter(language_code__in=languages),
+            )
+        )
+
+
+ShopManager = TranslatableManager.from_queryset(ShopQuerySet)
+
 
 # Create your models here.
 class Category(TranslatableModel):
@@ -9,6 +31,8 @@ class Category(TranslatableModel):
         slug = models.SlugField(max_length=200, unique=True, allow_unicode=True),
     )
 
+    objects = ShopManager()
+
     class Meta:
         # ordering = ['name']
         # indexes = [models.Index(fields=['name'])]
@@ -31,22 +55,108 @@ class Product(TranslatableModel):
     )
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     image = models.ImageField(upload_to="products/%Y/%m/%d", blank=True)
+    # resized copies of the image, written by shop.tasks.generate_image_variants
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     available = models.BooleanField(default=True)
+    stock = models.PositiveIntegerField(null=True, blank=True, help_text="Units on hand, leave empty to not track stock")
+    # index of the SHOP_PRICE_BUCKETS range the price falls in, kept by save()
+    price_bucket = models.PositiveSmallIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    objects = ShopManager()
+
     class Meta:
         # ordering = ['name']
         indexes = [
             # models.Index(fields=['id', 'slug']),
             # models.Index(fields=['name']),
             models.Index(fields=['-created']),
+            # faceted listings read newest first straight from these, available
+            # is left out as nearly every product matches it
+            models.Index(fields=['category', '-created', '-id']),
+            models.Index(fields=['category', 'price_bucket', '-created', '-id']),
+            models.Index(fields=['price_bucket', '-created', '-id']),
         ]
     
     def __str__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_facet_key()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # not when a deferred column is loaded, the instance may be changed already
+        if fields is None:
+            self.remember_facet_key()
+
+    def remember_facet_key(self):
+        # the FacetCount row the stored product is counted in, left unset when
+        # a column is deferred
+        if all(field in self.__dict__ for field in FACET_FIELDS):
+            self._facet_key = tuple(self.__dict__[field] for field in FACET_FIELDS)
+
+    def save(self, *args, **kwargs):
+        self.price_bucket = get_price_bucket(self.price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'price_bucket'}
+        super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse("shop:product_detail", args=[self.id, self.slug])
-    
\ No newline at end of file
+    
+
+
+# the columns products are counted by in FacetCount
+FACET_FIELDS = ('category_id', 'price_bucket', 'available')
+
+
+def get_price_bucket(price):
+    return bisect_right(settings.SHOP_PRICE_BUCKETS, price)
+
+
+class FacetCount(models.Model):
+    """
+    Number of products per category, price bucket and availability, kept up
+    to date by signals so the listing never counts products itself.
+    """
+    category = models.ForeignKey(Category, related_name='facet_counts', on_delete=models.CASCADE)
+    price_bucket = models.PositiveSmallIntegerField()
+    available = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'price_bucket', 'available'], name='unique_facet_count'),
+        ]
+
+    def __str__(self):
+        return f'{self.category_id}/{self.price_bucket}/{self.available}: {self.count}'
+
+
+class StockReservation(models.Model):
+    class Status(models.TextChoices):
+        RESERVED = 'reserved', 'Reserved'
+        COMMITTED = 'committed', 'Committed'
+        RELEASED = 'released', 'Released'
+
+    order = models.ForeignKey('orders.Order', related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RESERVED)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires']),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity}x {self.product_id} for order {self.order_id}'
@@ -0,0 +1,48 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+
+
+def encode_cursor(product):
+    raw = f"{product.created.isoformat()}|{product.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created, id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_page_size(value):
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return settings.SHOP_PAGE_SIZE
+    return max(1, min(page_size, settings.SHOP_MAX_PAGE_SIZE))
+
+
+def paginate_products(products, cursor=None, page_size=None):
+    """
+    Keyset pagination over (-created, -id), returns (page, next_cursor).
+
+    The cursor is the last product of the previous page, so every page is a
+    range scan on the -created index no matter how deep the shopper goes.
+    """
+    page_size = page_size or settings.SHOP_PAGE_SIZE
+    products = products.order_by('-created', '-id')
+
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created, id = position
+        products = products.filter(created__lte=created).exclude(created=created, id__gte=id)
+
+    page = list(products[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1])
+    return page, next_cursor
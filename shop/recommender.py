@@ -1,8 +1,129 @@
+import hashlib
+import heapq
+import logging
+import threading
+import time
 import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
 from shop.models import Product
 
-r = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+logger = logging.getLogger(__name__)
+
+# Writes (webhook tasks, rebuilds) can wait for Redis, storefront reads get a
+# pool of their own with the latency budget as socket timeout and no retries.
+r = redis.Redis(connection_pool=redis.ConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    health_check_interval=30,
+))
+storefront_r = redis.Redis(connection_pool=redis.ConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    socket_timeout=settings.RECOMMENDER_LATENCY_BUDGET,
+    socket_connect_timeout=settings.RECOMMENDER_LATENCY_BUDGET,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    retry=Retry(NoBackoff(), 0),
+))
+
+
+class RecommenderUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and lets a single
+    trial call through once ``reset_timeout`` seconds have passed.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'half-open':
+                # one trial call, the others keep short-circuiting until it reports
+                self.opened_at = time.monotonic()
+                return True
+            return self.state == 'closed'
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Recommender circuit opened after %s failures', self.failures)
+                self.opened_at = time.monotonic()
+
+
+class RecommenderMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.short_circuits = 0
+        self.fallbacks = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record_call(self, elapsed, failed=False, slow=False):
+        with self.lock:
+            self.calls += 1
+            self.failures += failed
+            self.slow_calls += slow
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def increment(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'state': breaker.state,
+                'calls': self.calls,
+                'failures': self.failures,
+                'slow_calls': self.slow_calls,
+                'short_circuits': self.short_circuits,
+                'fallbacks': self.fallbacks,
+                'avg_ms': self.total_time / self.calls * 1000 if self.calls else 0,
+                'max_ms': self.max_time * 1000,
+            }
+
+
+breaker = CircuitBreaker(settings.RECOMMENDER_FAILURE_THRESHOLD, settings.RECOMMENDER_RESET_TIMEOUT)
+metrics = RecommenderMetrics()
 
 
 class Recommender:
@@ -10,33 +131,176 @@ class Recommender:
         return f"product:{id}:purchased_with"
 
     def products_bought(self, products):
-        product_ids = [p.id for p in products]
-        for product_id in product_ids:
-            for with_id in product_ids:
-                if product_id != with_id:
-                    r.zincrby(self.get_product_key(product_id), 1, with_id)
+        self.orders_bought([[p.id for p in products]])
+
+    def orders_bought(self, orders, batch_size=10000):
+        """
+        Record the co-purchases of many orders, each one a list of product ids.
+
+        All increments go through one pipeline, flushed every ``batch_size``
+        commands, so an order costs a single round trip and historical orders
+        can be backfilled in bulk.
+        """
+        pipe = r.pipeline(transaction=False)
+        pending = 0
+        for product_ids in orders:
+            for product_id in product_ids:
+                for with_id in product_ids:
+                    if product_id != with_id:
+                        pipe.zincrby(self.get_product_key(product_id), 1, with_id)
+                        pending += 1
+            if pending >= batch_size:
+                pipe.execute()
+                pending = 0
+        if pending:
+            pipe.execute()
 
     def suggest_products_for(self, products, max_results=6):
-        product_ids = [p.id for p in products]
-        if len(products) == 1:
-            suggestions = r.zrange(self.get_product_key(product_ids[0]), 0, -1, desc=True)[:max_results]
-        else:
-            flat_ids = ''.join(str(id) for id in product_ids)
-            tmp_key = f"tmp_{flat_ids}"
-            keys = [self.get_product_key(id) for id in product_ids]
-            r.zunionstore(tmp_key, keys)
-            r.zrem(tmp_key, *product_ids)
-
-            suggestions = r.zrange(tmp_key, 0, -1, desc=True)[:max_results]
-            r.delete(tmp_key)
-
-        suggested_product_ids = [int(id) for id in suggestions]
-        suggested_products = list(Product.objects.filter(id__in=suggested_product_ids))
-        suggested_products.sort(key=lambda x: suggested_product_ids.index(x.id))
+        """
+        Never waits on Redis longer than RECOMMENDER_LATENCY_BUDGET, falls back
+        to the last suggestions cached for these products, or none at all.
+        """
+        product_ids = sorted({p.id for p in products})
+        language = get_language()
+        flat_ids = ','.join(str(id) for id in product_ids)
+        cache_key = f"recommender:{language}:{max_results}:{hashlib.md5(flat_ids.encode()).hexdigest()}"
+
+        suggested_products = cache.get(cache_key)
+        if suggested_products is None:
+            try:
+                suggested_product_ids = self.call_with_budget(self.get_suggested_ids, product_ids, max_results)
+            except RecommenderUnavailable:
+                metrics.increment('fallbacks')
+                return cache.get(f"{cache_key}:stale", [])
+
+            found = Product.objects.filter(id__in=suggested_product_ids).with_translations(language).in_bulk()
+            suggested_products = [found[id] for id in suggested_product_ids if id in found]
+            cache.set(cache_key, suggested_products, settings.RECOMMENDER_CACHE_TIMEOUT)
+            cache.set(f"{cache_key}:stale", suggested_products, settings.RECOMMENDER_STALE_TIMEOUT)
         return suggested_products
 
-    def clear_purchases(self):
-        for id in Product.objects.values_list('id', flat=True):
-            r.delete(self.get_product_key(id))
+    def call_with_budget(self, func, *args):
+        if not breaker.allow():
+            metrics.increment('short_circuits')
+            raise RecommenderUnavailable('circuit open')
+
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except redis.RedisError as e:
+            metrics.record_call(time.perf_counter() - start, failed=True)
+            breaker.record_failure()
+            raise RecommenderUnavailable(str(e)) from e
+
+        elapsed = time.perf_counter() - start
+        slow = elapsed > settings.RECOMMENDER_LATENCY_BUDGET
+        metrics.record_call(elapsed, slow=slow)
+        if slow:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return result
+
+    def get_suggested_ids(self, product_ids, max_results):
+        if not product_ids:
+            return []
+        if len(product_ids) == 1:
+            suggestions = storefront_r.zrange(self.get_product_key(product_ids[0]), 0, max_results - 1, desc=True)
+            return [int(id) for id in suggestions]
+
+        # Read-only union: fetch the top of every set in one round trip and sum
+        # the scores here. Products outside every window are ignored, which
+        # only matters for ties far below the top results.
+        window = max_results * settings.RECOMMENDER_MERGE_WINDOW + len(product_ids)
+        pipe = storefront_r.pipeline(transaction=False)
+        for id in product_ids:
+            pipe.zrange(self.get_product_key(id), 0, window - 1, desc=True, withscores=True)
+
+        scores = {}
+        for suggestions in pipe.execute():
+            for id, score in suggestions:
+                scores[int(id)] = scores.get(int(id), 0) + score
+        for id in product_ids:
+            scores.pop(id, None)
+        return heapq.nlargest(max_results, scores, key=scores.get)
+
+    def replace_purchases(self, related, batch_size=1000):
+        """
+        Replace every co-purchase set with ``related``, a mapping of product id
+        to ``{with_id: score}``.
+
+        The new sets are written under a versioned prefix, then renamed over
+        the live keys and the live keys missing from ``related`` are unlinked,
+        ``batch_size`` keys per MULTI so neither this process nor Redis ever
+        handles every key at once. Readers see old and new sets side by side
+        until the last batch is applied.
+        """
+        prefix = f"rebuild:{time.time_ns()}:"
+        keys = [self.get_product_key(product_id) for product_id, scores in related.items() if scores]
+        pipe = r.pipeline(transaction=False)
+        for i, (product_id, scores) in enumerate(related.items(), 1):
+            if scores:
+                pipe.zadd(prefix + self.get_product_key(product_id), scores)
+            if i % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        for start in range(0, len(keys), batch_size):
+            pipe = r.pipeline()
+            for key in keys[start:start + batch_size]:
+                pipe.rename(prefix + key, key)
+            pipe.execute()
+
+        keep = {key.encode() for key in keys}
+        stale = []
+        for key in r.scan_iter(match=self.get_product_key('*'), count=batch_size):
+            if key not in keep:
+                stale.append(key)
+            if len(stale) >= batch_size:
+                r.unlink(*stale)
+                stale = []
+        if stale:
+            r.unlink(*stale)
+
+    def decay_purchases(self, factor, max_related, min_score, batch_size=1000):
+        """
+        Multiply every co-purchase score by ``factor``, drop pairs below
+        ``min_score`` and keep only the ``max_related`` best of each set.
+
+        Run periodically this gives exponential time decay, new purchases add 1
+        while older ones keep shrinking, and bounds the memory of every set.
+        Sets left empty are removed by Redis itself.
+        """
+        pipe = r.pipeline(transaction=False)
+        for i, key in enumerate(r.scan_iter(match=self.get_product_key('*'), count=batch_size), 1):
+            pipe.zunionstore(key, {key: factor})
+            pipe.zremrangebyscore(key, '-inf', f'({min_score}')
+            pipe.zremrangebyrank(key, 0, -(max_related + 1))
+            if i % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def get_popularity(self, product_ids, batch_size=1000):
+        """
+        Return ``{product_id: number of products bought with it}``, read with
+        pipelined ZCARDs.
+        """
+        popularity = {}
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            pipe = r.pipeline(transaction=False)
+            for product_id in batch:
+                pipe.zcard(self.get_product_key(product_id))
+            popularity.update(zip(batch, pipe.execute()))
+        return popularity
 
-    
\ No newline at end of file
+    def clear_purchases(self, batch_size=1000):
+        batch = []
+        for key in r.scan_iter(match=self.get_product_key('*'), count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                r.unlink(*batch)
+                batch = []
+        if batch:
+            r.unlink(*batch)
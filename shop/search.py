@@ -0,0 +1,125 @@
+import re
+import sqlite3
+import threading
+from django.conf import settings
+
+# name matches weigh more than description matches in the BM25 score
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+TOKENIZERS = {
+    'en': 'porter unicode61 remove_diacritics 2',
+}
+DEFAULT_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+_local = threading.local()
+
+
+def get_table(language_code):
+    return 'products_' + re.sub(r'\W', '_', language_code)
+
+
+def create_tables(connection):
+    for language_code, _ in settings.LANGUAGES:
+        tokenizer = TOKENIZERS.get(language_code, DEFAULT_TOKENIZER)
+        connection.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {get_table(language_code)} "
+            f"USING fts5(name, description, tokenize='{tokenizer}')"
+        )
+
+
+def get_connection():
+    """
+    One connection per thread to the FTS5 index, stored in its own SQLite
+    file next to the other private data whatever the main database is.
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        settings.SEARCH_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(settings.SEARCH_INDEX_PATH, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        create_tables(connection)
+        _local.connection = connection
+    return connection
+
+
+def close_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+def get_product_rows(product_ids=None):
+    # (language_code, product_id, name, description) of every available product
+    from shop.models import Product
+    translations = Product._parler_meta.root_model.objects.filter(master__available=True)
+    if product_ids is not None:
+        translations = translations.filter(master_id__in=product_ids)
+    return translations.values_list('language_code', 'master_id', 'name', 'description').iterator(chunk_size=2000)
+
+
+def write_rows(connection, rows):
+    tables = {language_code: get_table(language_code) for language_code, _ in settings.LANGUAGES}
+    for language_code, product_id, name, description in rows:
+        if language_code in tables:
+            connection.execute(
+                f"INSERT INTO {tables[language_code]} (rowid, name, description) VALUES (?, ?, ?)",
+                (product_id, name, description),
+            )
+
+
+def update_products(product_ids):
+    """
+    Re-index ``product_ids`` in every language from the database, products
+    that are unavailable or gone are only removed.
+    """
+    connection = get_connection()
+    with connection:
+        for language_code, _ in settings.LANGUAGES:
+            connection.executemany(
+                f"DELETE FROM {get_table(language_code)} WHERE rowid = ?",
+                [(product_id,) for product_id in product_ids],
+            )
+        write_rows(connection, get_product_rows(product_ids))
+
+
+def rebuild():
+    connection = get_connection()
+    with connection:
+        for language_code, _ in settings.LANGUAGES:
+            connection.execute(f"DROP TABLE IF EXISTS {get_table(language_code)}")
+        create_tables(connection)
+        write_rows(connection, get_product_rows())
+        # merge the b-tree segments written by the inserts into one
+        for language_code, _ in settings.LANGUAGES:
+            table = get_table(language_code)
+            connection.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+
+
+def build_query(text):
+    # every word must match, the last one as a prefix since it may not be
+    # finished, quoted so FTS5 operators in the input are taken literally
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(text, language_code, limit, offset=0):
+    """
+    Return the ids of the products matching ``text`` in ``language_code``,
+    best BM25 score first.
+    """
+    query = build_query(text)
+    if query is None:
+        return []
+    table = get_table(language_code)
+    rows = get_connection().execute(
+        f"SELECT rowid FROM {table} WHERE {table} MATCH ? "
+        f"ORDER BY bm25({table}, ?, ?) LIMIT ? OFFSET ?",
+        (query, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit, offset),
+    )
+    return [product_id for product_id, in rows]
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from shop import autocomplete, facets, images
+from shop.models import FACET_FIELDS, Category, Product
+
+ProductTranslation = Product._parler_meta.root_model
+CategoryTranslation = Category._parler_meta.root_model
+
+
+def update_search_index(product_id):
+    # the index lives outside the main database, only touch it once the change
+    # is committed, from a worker that retries while the index is locked
+    from shop import tasks
+    transaction.on_commit(lambda: tasks.update_search_index.delay([product_id]), robust=True)
+
+
+def update_autocomplete():
+    transaction.on_commit(autocomplete.schedule_rebuild, robust=True)
+
+
+def updates_facet(update_fields):
+    return update_fields is None or not {'category', *FACET_FIELDS}.isdisjoint(update_fields)
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet_key(sender, instance, update_fields=None, **kwargs):
+    # the key is kept by the instance from when it was loaded or last saved,
+    # only read here for a product loaded without it or saved with a given pk
+    if not updates_facet(update_fields):
+        return
+    if instance._state.adding and instance.pk is None:
+        instance._facet_key = None
+    elif instance._state.adding or not hasattr(instance, '_facet_key'):
+        instance._facet_key = Product.objects.filter(pk=instance.pk).values_list(*FACET_FIELDS).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    if updates_facet(update_fields):
+        facet_key = facets.get_facet_key(instance)
+        facets.move(instance._facet_key, facet_key)
+        instance._facet_key = facet_key
+    update_search_index(instance.id)
+    update_autocomplete()
+    if not images.is_up_to_date(instance, check_source=True):
+        from shop.tasks import generate_image_variants
+        transaction.on_commit(lambda: generate_image_variants.delay(instance.id), robust=True)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    facets.adjust(facets.get_facet_key(instance), -1)
+    update_search_index(instance.id)
+    update_autocomplete()
+    if instance.image_variants:
+        variants = instance.image_variants
+        transaction.on_commit(lambda: images.delete_variants(variants), robust=True)
+
+
+@receiver([post_save, post_delete], sender=ProductTranslation)
+def product_translation_changed(sender, instance, **kwargs):
+    update_search_index(instance.master_id)
+    update_autocomplete()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=CategoryTranslation)
+def category_changed(sender, instance, **kwargs):
+    update_autocomplete()
@@ -0,0 +1,45 @@
+import logging
+import sqlite3
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import caches
+from shop import autocomplete, images, inventory, search
+from shop.models import Product
+from shop.recommender import Recommender
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def release_expired_reservations():
+    return inventory.release_expired_reservations()
+
+
+@shared_task
+def decay_recommendations():
+    factor = 0.5 ** (settings.RECOMMENDER_DECAY_INTERVAL / settings.RECOMMENDER_DECAY_HALF_LIFE)
+    Recommender().decay_purchases(factor, settings.RECOMMENDER_MAX_RELATED, settings.RECOMMENDER_MIN_SCORE)
+
+
+@shared_task(bind=True, max_retries=settings.SEARCH_INDEX_MAX_RETRIES)
+def update_search_index(self, product_ids):
+    try:
+        search.update_products(product_ids)
+    except sqlite3.OperationalError as exc:
+        # "database is locked" while a rebuild or another worker holds the index
+        logger.warning('Could not update the search index for products %s: %s', product_ids, exc)
+        raise self.retry(exc=exc, countdown=settings.SEARCH_INDEX_RETRY_DELAY * 2 ** self.request.retries)
+
+
+@shared_task
+def rebuild_autocomplete():
+    # catalog changes from now on schedule the next rebuild
+    caches['shared'].delete(autocomplete.REBUILD_SCHEDULED_KEY)
+    return autocomplete.rebuild()
+
+
+@shared_task
+def generate_image_variants(product_id):
+    product = Product.objects.filter(id=product_id).only('id', 'image', 'image_variants').first()
+    if product is not None and not images.is_up_to_date(product, check_source=True):
+        images.update_variants(product)
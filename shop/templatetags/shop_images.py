@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import format_html
+from shop.images import is_up_to_date
+
+register = template.Library()
+
+
+def get_srcset(variants):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, name in variants)
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', lazy=True):
+    """
+    The product image as a <picture> with WebP and JPEG srcsets, the browser
+    picks the smallest variant that fills ``sizes``. Falls back to the
+    original upload until its variants are generated.
+    """
+    loading = 'lazy' if lazy else 'eager'
+    if not product.image:
+        return format_html('<img src="{}" alt="{}">', static('img/no_image.png'), product.name)
+    variants = product.image_variants
+    if not is_up_to_date(product) or not variants.get('jpeg'):
+        return format_html('<img src="{}" alt="{}" loading="{}">', product.image.url, product.name, loading)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="{}" decoding="async">'
+        '</picture>',
+        get_srcset(variants['webp']), sizes,
+        default_storage.url(variants['jpeg'][-1][1]), get_srcset(variants['jpeg']), sizes,
+        variants['width'], variants['height'], product.name, loading,
+    )
@@ -1,3 +1,495 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+import fakeredis
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+from core.celery import app as celery_app
+from orders.models import Order
+from orders.services import place_order
+from shop import autocomplete, facets, images, inventory, search, tasks
+from shop.inventory import InsufficientStock
+from shop.models import Category, FacetCount, Product, StockReservation
+from shop.recommender import Recommender
 
-# Create your tests here.
+
+def create_product(category=None, **kwargs):
+    if category is None:
+        category = Category.objects.language('en').create(name='Tea', slug=f'tea-{Category.objects.count()}')
+    slug = f'tea-{Product.objects.count()}'
+    return Product.objects.language('en').create(**{
+        'category': category, 'name': slug, 'slug': slug, 'price': Decimal('10.00'), **kwargs,
+    })
+
+
+def use_celery_eager(test):
+    test.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+    celery_app.conf.task_always_eager = True
+
+
+def use_search_index(test):
+    location = tempfile.TemporaryDirectory()
+    test.addCleanup(location.cleanup)
+    index_override = override_settings(SEARCH_INDEX_PATH=Path(location.name) / 'search.sqlite3')
+    index_override.enable()
+    test.addCleanup(index_override.disable)
+    # the connection of this thread is opened again on the new path
+    search.close_connection()
+    test.addCleanup(search.close_connection)
+
+
+@mock.patch('shop.signals.update_autocomplete')
+@mock.patch('shop.signals.update_search_index')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    stock = 50
+    checkouts = 200
+
+    def checkout(self, product_id):
+        order = Order(first_name='A', last_name='B', email='a@example.com', address='1 Street', postal_code='1000', city='City')
+        try:
+            place_order(order, [(product_id, 1)])
+            return True
+        except InsufficientStock:
+            return False
+        finally:
+            connection.close()
+
+    @mock.patch('orders.services.order_created')
+    def test_stock_is_never_oversold(self, order_created, *mocks):
+        product = create_product(stock=self.stock)
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(self.checkout, [product.id] * self.checkouts))
+
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(results.count(False), self.checkouts - self.stock)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(StockReservation.objects.filter(product=product).count(), self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
+        self.assertEqual(order_created.delay.call_count, self.stock)
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.products = [create_product(stock=10), create_product(stock=10), create_product(stock=None)]
+
+    def test_take_and_return_stock(self):
+        quantities = {self.products[0].id: 3, self.products[1].id: 5, self.products[2].id: 1}
+        self.assertEqual(inventory.take_stock(quantities), 3)
+        self.assertEqual(inventory.take_stock({self.products[1].id: 6}), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(inventory.return_stock(quantities), 3)
+        stocks = list(Product.objects.order_by('id').values_list('stock', flat=True))
+        self.assertEqual(stocks, [10, 10, None])
+
+    @mock.patch('orders.services.order_created')
+    def test_release_expired_reservations(self, order_created):
+        order = Order(first_name='A', last_name='B', email='a@example.com', address='1 Street', postal_code='1000', city='City')
+        place_order(order, [(self.products[0].id, 2), (self.products[1].id, 4)])
+        self.assertEqual(inventory.release_expired_reservations(), 0)
+
+        order.reservations.update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(inventory.release_expired_reservations(), 2)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)[:2]), [10, 10])
+        self.assertFalse(order.reservations.exclude(status=StockReservation.Status.RELEASED).exists())
+
+
+@mock.patch('shop.recommender.r', new_callable=fakeredis.FakeRedis)
+class ReplacePurchasesTests(TestCase):
+    def test_replace_purchases(self, r):
+        rec = Recommender()
+        for product_id in (1, 2, 3):
+            r.zadd(rec.get_product_key(product_id), {99: 5})
+
+        rec.replace_purchases({1: {2: 3.0}, 4: {1: 1.0, 2: 2.0}, 5: {}}, batch_size=1)
+
+        self.assertEqual(sorted(r.keys()), sorted(rec.get_product_key(id).encode() for id in (1, 4)))
+        self.assertEqual(r.zrange(rec.get_product_key(1), 0, -1, withscores=True), [(b'2', 3.0)])
+        self.assertEqual(r.zrange(rec.get_product_key(4), 0, -1, withscores=True), [(b'1', 1.0), (b'2', 2.0)])
+
+
+@mock.patch('shop.signals.update_autocomplete')
+class SearchTests(TestCase):
+    def setUp(self):
+        use_search_index(self)
+        use_celery_eager(self)
+        self.category = Category.objects.language('en').create(name='Tea', slug='tea')
+
+    def create_product(self, name, description=''):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_product(self.category, name=name, description=description)
+
+    def test_ranking(self, update_autocomplete):
+        described = self.create_product('Sencha', 'A green tea from Shizuoka')
+        named = self.create_product('Green tea')
+        self.create_product('Black tea')
+        with self.captureOnCommitCallbacks(execute=True):
+            translated = create_product(self.category, name='Green tea bag')
+            translated.set_current_language('es')
+            translated.name = 'Té verde'
+            translated.save()
+
+        self.assertEqual(search.search('green tea', 'en', 10), [named.id, translated.id, described.id])
+        # the last word as a prefix, English words by their stem
+        self.assertEqual(search.search('green te', 'en', 10), [named.id, translated.id, described.id])
+        self.assertEqual(search.search('bags', 'en', 10), [translated.id])
+        # accents are ignored, each language in its own table
+        self.assertEqual(search.search('te verde', 'es', 10), [translated.id])
+        self.assertEqual(search.search('green tea', 'en', 1, offset=1), [translated.id])
+        self.assertEqual(search.search('"); DROP', 'en', 10), [])
+
+    def test_index_follows_changes(self, update_autocomplete):
+        product = self.create_product('Green tea')
+        self.assertEqual(search.search('green', 'en', 10), [product.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Jasmine tea'
+            product.save()
+        self.assertEqual(search.search('green', 'en', 10), [])
+        self.assertEqual(search.search('jasmine', 'en', 10), [product.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.available = False
+            product.save()
+        self.assertEqual(search.search('jasmine', 'en', 10), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.available = True
+            product.save()
+        self.assertEqual(search.search('jasmine', 'en', 10), [product.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(search.search('jasmine', 'en', 10), [])
+
+    def test_search_view(self, update_autocomplete):
+        product = self.create_product('Green tea')
+        response = self.client.get(reverse('shop:product_search'), {'q': 'green'})
+        self.assertEqual(response.context['products'], [product])
+
+    def test_locked_index_is_retried(self, update_autocomplete):
+        product = self.create_product('Green tea')
+        locked = sqlite3.OperationalError('database is locked')
+        with (
+            mock.patch('shop.search.update_products', side_effect=[locked, None]) as update_products,
+            self.assertLogs('shop.tasks', 'WARNING') as logs,
+        ):
+            tasks.update_search_index.delay([product.id])
+        self.assertEqual(update_products.call_count, 2)
+        self.assertIn('database is locked', logs.output[0])
+
+
+@mock.patch('shop.signals.update_autocomplete')
+@mock.patch('shop.signals.update_search_index')
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.tea = Category.objects.language('en').create(name='Tea', slug='tea')
+        self.coffee = Category.objects.language('en').create(name='Coffee', slug='coffee')
+
+    def get_counts(self):
+        return {
+            (row.category_id, row.price_bucket, row.available): row.count
+            for row in FacetCount.objects.filter(count__gt=0)
+        }
+
+    def assertCounts(self, expected):
+        counts = self.get_counts()
+        self.assertEqual(counts, expected)
+        # the same as counting the products from scratch
+        facets.rebuild()
+        self.assertEqual(self.get_counts(), counts)
+
+    def test_counts_follow_product_changes(self, *mocks):
+        product = create_product(self.tea, price=Decimal('10.00'))
+        create_product(self.tea, price=Decimal('30.00'))
+        self.assertCounts({(self.tea.id, 0, True): 1, (self.tea.id, 1, True): 1})
+
+        # edited as loaded from the database, and again on the same instance
+        product = Product.objects.get(id=product.id)
+        product.price = Decimal('60.00')
+        product.save()
+        product.category = self.coffee
+        product.save()
+        self.assertCounts({(self.coffee.id, 2, True): 1, (self.tea.id, 1, True): 1})
+
+        product.available = False
+        product.save(update_fields=['available'])
+        self.assertCounts({(self.coffee.id, 2, False): 1, (self.tea.id, 1, True): 1})
+        product.available = True
+        product.save()
+        self.assertCounts({(self.coffee.id, 2, True): 1, (self.tea.id, 1, True): 1})
+
+        # changed behind the instance's back, then refreshed
+        Product.objects.filter(id=product.id).update(available=False)
+        facets.rebuild()
+        product.refresh_from_db()
+        product.price = Decimal('10.00')
+        product.save()
+        self.assertCounts({(self.coffee.id, 0, False): 1, (self.tea.id, 1, True): 1})
+
+        product.delete()
+        self.assertCounts({(self.tea.id, 1, True): 1})
+
+    def test_deferred_facet_columns(self, *mocks):
+        product = create_product(self.tea, price=Decimal('10.00'))
+        product = Product.objects.only('id', 'stock').get(id=product.id)
+        product.stock = 5
+        product.save()
+        product = Product.objects.only('id', 'available').get(id=product.id)
+        product.available = False
+        product.save()
+        self.assertCounts({(self.tea.id, 0, False): 1})
+
+    def test_saving_does_not_read_the_facet_key(self, *mocks):
+        product = Product.objects.get(id=create_product(self.tea).id)
+        product.available = False
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+            product.save(update_fields=['stock'])
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'FROM "shop_product"' in query['sql']]
+        self.assertEqual(selects, [])
+        self.assertCounts({(self.tea.id, 0, False): 1})
+
+
+@mock.patch('shop.recommender.r', new_callable=fakeredis.FakeRedis)
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.directory = Path(location.name)
+        settings_override = override_settings(AUTOCOMPLETE_DIR=self.directory, AUTOCOMPLETE_RELOAD_INTERVAL=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # forget the snapshot this process loaded before
+        patch_snapshot = mock.patch.multiple(autocomplete, _snapshot=None, _checked=0.0)
+        patch_snapshot.start()
+        self.addCleanup(patch_snapshot.stop)
+
+        tea = Category.objects.language('en').create(name='Tea', slug='tea')
+        coffee = Category.objects.language('en').create(name='Coffee', slug='coffee')
+        self.green_tea = create_product(tea, name='Green tea')
+        self.black_tea = create_product(tea, name='Black tea')
+        self.coffee = create_product(coffee, name='Green café')
+        create_product(tea, name='Green mate', available=False)
+        self.popularity = {self.green_tea.id: 3, self.black_tea.id: 2, self.coffee.id: 1}
+
+    def suggest(self, text, language_code='en', limit=10):
+        return [json.loads(payload)['name'] for payload in autocomplete.suggest(text, language_code, limit)]
+
+    def rebuild(self, r):
+        for product_id, count in self.popularity.items():
+            r.zadd(f'product:{product_id}:purchased_with', {i: 1 for i in range(count)})
+        return autocomplete.rebuild()
+
+    def test_prefix_results_and_ranking(self, r):
+        self.rebuild(r)
+        # most popular first, categories by the popularity of their products
+        self.assertEqual(self.suggest('gre'), ['Green tea', 'Green café'])
+        self.assertEqual(self.suggest('tea'), ['Tea', 'Green tea', 'Black tea'])
+        # the precomputed short prefixes, from the start of any word
+        self.assertEqual(self.suggest('te'), ['Tea', 'Green tea', 'Black tea'])
+        self.assertEqual(self.suggest('t', limit=2), ['Tea', 'Green tea'])
+        self.assertEqual(self.suggest('green t'), ['Green tea'])
+        self.assertEqual(self.suggest('CAFE'), ['Green café'])
+        self.assertEqual(self.suggest('mate'), [])
+        self.assertEqual(self.suggest('xy'), [])
+        self.assertEqual(self.suggest(' '), [])
+        # untranslated names fall back to English
+        self.assertEqual(self.suggest('gre', 'es'), ['Green tea', 'Green café'])
+
+        payload = json.loads(autocomplete.suggest('black', 'en', 10)[0])
+        self.assertEqual(payload, {
+            'type': 'product', 'id': self.black_tea.id, 'name': 'Black tea', 'url': self.black_tea.get_absolute_url(),
+        })
+
+    def test_view(self, r):
+        self.rebuild(r)
+        response = self.client.get(reverse('shop:product_autocomplete'), {'q': 'coff'})
+        self.assertEqual([result['name'] for result in response.json()['results']], ['Coffee'])
+
+    def test_snapshots_are_swapped(self, r):
+        self.assertEqual(self.suggest('gre'), [])
+        first = self.rebuild(r)
+        self.assertEqual((self.directory / 'CURRENT').read_text(), first)
+        snapshot = autocomplete.get_snapshot()
+        self.assertEqual(snapshot.name, first)
+        self.assertEqual(self.suggest('gre'), ['Green tea', 'Green café'])
+        # the arrays are read from the page cache, not copied into the process
+        self.assertIsInstance(snapshot.get_language('en')['keys'], np.memmap)
+
+        create_product(name='Green rooibos')
+        second = self.rebuild(r)
+        self.assertEqual(autocomplete.get_snapshot().name, second)
+        self.assertEqual(self.suggest('green r'), ['Green rooibos'])
+
+        # the snapshot before the current one is kept for workers that still use it
+        self.rebuild(r)
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir() if path.is_dir())[0], second)
+        self.assertEqual(len([path for path in self.directory.iterdir() if path.is_dir()]), 2)
+
+    @mock.patch('shop.tasks.rebuild_autocomplete.apply_async')
+    def test_one_rebuild_per_delay(self, apply_async, r):
+        autocomplete.schedule_rebuild()
+        # the flag is in the database, so another process sees it as well
+        caches['default'].clear()
+        autocomplete.schedule_rebuild()
+        apply_async.assert_called_once_with(countdown=settings.AUTOCOMPLETE_REBUILD_DELAY)
+
+        with mock.patch('shop.autocomplete.rebuild'):
+            tasks.rebuild_autocomplete()
+        autocomplete.schedule_rebuild()
+        self.assertEqual(apply_async.call_count, 2)
+
+
+def make_image(color, size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='tea.png')
+
+
+@override_settings(PRODUCT_IMAGE_WIDTHS=[160, 320, 1280])
+@mock.patch('shop.signals.update_autocomplete')
+@mock.patch('shop.signals.update_search_index')
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        media_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location.name, 'base_url': '/media/'}}
+        storages_override = override_settings(STORAGES={**settings.STORAGES, 'default': media_storage})
+        storages_override.enable()
+        self.addCleanup(storages_override.disable)
+        use_celery_eager(self)
+
+    def render(self, product):
+        return Template('{% load shop_images %}{% product_image product sizes="180px" %}').render(Context({'product': product}))
+
+    def create_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return create_product(image=make_image('green'))
+
+    def overwrite_image(self, product, color):
+        # replaced in place by another tool, with a later modification time
+        path = default_storage.path(product.image.name)
+        with open(path, 'wb') as f:
+            Image.new('RGB', (800, 600), color).save(f, 'PNG')
+        modified = os.stat(path).st_mtime + 10
+        os.utime(path, (modified, modified))
+
+    def test_variants_are_generated_on_save(self, *mocks):
+        product = self.create_product()
+        product.refresh_from_db()
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual((variants['width'], variants['height']), (800, 600))
+        self.assertEqual([width for width, _ in variants['jpeg']], [160, 320, 800])
+        for name in images.get_variant_names(variants):
+            self.assertTrue(default_storage.exists(name), name)
+        self.assertTrue(images.is_up_to_date(product, check_source=True))
+
+        html = self.render(product)
+        self.assertIn('<picture>', html)
+        self.assertIn(f'srcset="{default_storage.url(variants["webp"][0][1])} 160w, ', html)
+        self.assertIn(f'<img src="{default_storage.url(variants["jpeg"][-1][1])}"', html)
+        self.assertIn('width="800" height="600"', html)
+
+    def test_original_is_shown_until_the_variants_exist(self, *mocks):
+        with mock.patch('shop.tasks.generate_image_variants.delay') as delay:
+            product = self.create_product()
+        delay.assert_called_once_with(product.id)
+        html = self.render(product)
+        self.assertNotIn('<picture>', html)
+        self.assertIn(f'src="{product.image.url}"', html)
+
+    def test_overwritten_image_gets_new_variants(self, *mocks):
+        product = self.create_product()
+        product.refresh_from_db()
+        old_names = images.get_variant_names(product.image_variants)
+
+        self.overwrite_image(product, 'red')
+        self.assertTrue(images.is_up_to_date(product))
+        self.assertFalse(images.is_up_to_date(product, check_source=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        new_names = images.get_variant_names(product.image_variants)
+        self.assertTrue(new_names.isdisjoint(old_names))
+        self.assertFalse(any(default_storage.exists(name) for name in old_names))
+        self.assertTrue(all(default_storage.exists(name) for name in new_names))
+        with default_storage.open(product.image_variants['jpeg'][0][1]) as f:
+            red, green, blue = Image.open(f).convert('RGB').getpixel((0, 0))
+        # JPEG, so only about red
+        self.assertGreater(red, 240)
+        self.assertLess(green, 16)
+
+    def test_variants_are_deleted_with_the_product(self, *mocks):
+        product = self.create_product()
+        product.refresh_from_db()
+        names = images.get_variant_names(product.image_variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+
+@mock.patch('shop.signals.update_autocomplete')
+@mock.patch('shop.signals.update_search_index')
+class ProductListQueryCountTests(TestCase):
+    # the same number of queries for 1 and 40 products, their translations and
+    # the categories' are each loaded with one query
+    product_counts = [1, 40]
+
+    def create_catalog(self, product_count):
+        categories = []
+        for name in ('Tea', 'Coffee'):
+            category = Category.objects.language('en').create(name=name, slug=f'{name.lower()}-{product_count}')
+            category.set_current_language('es')
+            category.name, category.slug = f'{name} es', f'{name.lower()}-es-{product_count}'
+            category.save()
+            categories.append(category)
+        for i in range(product_count):
+            product = create_product(categories[0], price=Decimal(10 + i))
+            product.set_current_language('es')
+            product.name, product.slug = f'Producto {i}', f'producto-{i}'
+            product.save()
+        return categories
+
+    def test_product_list(self, *mocks):
+        for product_count in self.product_counts:
+            category = self.create_catalog(product_count)[0]
+            for language, name in (('en', 'tea-'), ('es', 'Producto ')):
+                # the requests activate the language of the URL in this thread, restored after
+                with translation.override(language):
+                    urls = [
+                        # categories, their translations, facet counts, products, their translations and the session
+                        (reverse('shop:product_list'), 6),
+                        # and the category looked up by its slug
+                        (reverse('shop:product_list_by_category', args=[category.safe_translation_getter('slug', language_code=language)]), 7),
+                    ]
+                    for url, queries in urls:
+                        with self.subTest(products=product_count, url=url):
+                            # the first request of the session also stores the empty cart in it
+                            self.client.get(url)
+                            with self.assertNumQueries(queries):
+                                response = self.client.get(url)
+                            products = response.context['products']
+                            self.assertEqual(len(products), min(product_count, settings.SHOP_PAGE_SIZE))
+                            for product in products:
+                                self.assertContains(response, product.name)
+                                self.assertTrue(product.name.startswith(name))
@@ -5,6 +5,9 @@ app_name = "shop"
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('search/', views.product_search, name='product_search'),
+    path('autocomplete/', views.product_autocomplete, name='product_autocomplete'),
+    path('metrics/recommender/', views.recommender_metrics, name='recommender_metrics'),
     path('<int:id>/<slug:slug>/', views.product_detail, name='product_detail'),
     path('<slug:category_slug>/', views.product_list, name='product_list_by_category'),
 ]
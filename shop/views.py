@@ -1,23 +1,44 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from shop.models import Category, Product
 from cart.forms import CartAddProductForm
-from shop.recommender import Recommender
+from shop.recommender import Recommender, metrics
+from shop.pagination import get_page_size, paginate_products
+from shop import autocomplete, facets, search
 # Create your views here.
 
 
 def product_list(request, category_slug=None):
+    language = request.LANGUAGE_CODE
     category = None
-    categories = Category.objects.all()
-    products = Product.objects.filter(available=True)
+    categories = list(Category.objects.with_translations(language))
+    available = request.GET.get('availability') != 'unavailable'
+    price_buckets = facets.get_price_buckets(request.GET.getlist('price'))
+    products = Product.objects.filter(available=available).with_translations(language)
 
     if category_slug:
-        language = request.LANGUAGE_CODE
-
         category = get_object_or_404(
             Category, 
             translations__language_code=language,
             translations__slug=category_slug)
         products = products.filter(category=category)
+    if price_buckets:
+        products = products.filter(price_bucket__in=price_buckets)
+
+    category_counts, price_counts, availability_counts = facets.get_counts(category, price_buckets, available)
+    for c in categories:
+        c.product_count = category_counts[c.id]
+
+    page_size = get_page_size(request.GET.get('page_size'))
+    products, next_cursor = paginate_products(products, request.GET.get('cursor'), page_size)
+
+    next_query = None
+    if next_cursor:
+        query = request.GET.copy()
+        query['cursor'] = next_cursor
+        next_query = query.urlencode()
 
     return render(
         request,
@@ -25,11 +46,56 @@ def product_list(request, category_slug=None):
         {
             'category': category, 
             'categories': categories, 
-            'products': products
+            'products': products,
+            'next_query': next_query,
+            'filter_query': facets.get_filter_query(request.GET).urlencode(),
+            'price_options': facets.get_price_options(request.GET, price_buckets, price_counts),
+            'availability_options': facets.get_availability_options(request.GET, available, availability_counts),
+        }
+    )
+
+
+def product_search(request):
+    language = request.LANGUAGE_CODE
+    query = request.GET.get('q', '').strip()
+    categories = Category.objects.with_translations(language)
+
+    page_size = get_page_size(request.GET.get('page_size'))
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    product_ids = search.search(query, language, page_size + 1, (page - 1) * page_size)
+
+    next_query = None
+    if len(product_ids) > page_size:
+        product_ids = product_ids[:page_size]
+        next_query = request.GET.copy()
+        next_query['page'] = page + 1
+        next_query = next_query.urlencode()
+
+    # keep the ranking of the index
+    products = Product.objects.filter(available=True).with_translations(language).in_bulk(product_ids)
+    products = [products[product_id] for product_id in product_ids if product_id in products]
+
+    return render(
+        request,
+        'shop/product/list.html',
+        {
+            'categories': categories,
+            'products': products,
+            'next_query': next_query,
+            'query': query,
         }
     )
 
 
+def product_autocomplete(request):
+    # the snapshot stores every suggestion as serialized JSON already
+    suggestions = autocomplete.suggest(request.GET.get('q', ''), request.LANGUAGE_CODE, settings.AUTOCOMPLETE_MAX_RESULTS)
+    return HttpResponse(b'{"results": [' + b', '.join(suggestions) + b']}', content_type='application/json')
+
+
 def product_detail(request, id, slug):
     language = request.LANGUAGE_CODE
     product = get_object_or_404(Product, id=id, translations__language_code=language, translations__slug=slug, available=True)  
@@ -41,4 +107,9 @@ def product_detail(request, id, slug):
 
     return render(request,
                   'shop/product/detail.html',
-                  {'product': product, "cart_product_form": cart_product_form, "recommended_products": recommended_products})
\ No newline at end of file
+                  {'product': product, "cart_product_form": cart_product_form, "recommended_products": recommended_products})
+
+
+@staff_member_required
+def recommender_metrics(request):
+    return JsonResponse(metrics.as_dict())